@@ -1,26 +1,43 @@
 # app.py
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Blueprint, Flask, Response, render_template, request, jsonify, session, redirect, url_for, g
 import random
 import json
+import logging
 import os
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-app = Flask(__name__, static_folder='static', static_url_path='/static')
-app.secret_key = os.urandom(24)  # For session management
-
-
-# Load song database
-def load_songs():
-    if os.path.exists('songs.json'):
+from catalog import ResidentCatalog, SongTable, check_song_batch, install_reload_signal, iter_songs, write_songs
+from daily import DailySchedule
+from session_store import ServerSideSessionInterface, create_session_store
+from storage import storage_from_env
+from itunes import get_preview_url, preview_cache, preview_cache_key
+from sampler import ShuffledWalk
+import metrics
+
+# Per-request details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.histogram(
+    'yearworm_http_request_seconds', "Time to handle each request, by route.", ['route', 'method'])
+REQUESTS = metrics.counter('yearworm_http_requests_total', "Requests handled, by route and status.", ['route', 'status'])
+
+# Routes are registered on the app built by create_app()
+routes = Blueprint('game', __name__)
+
+
+# Read song database from disk into a compact SongTable
+def read_songs_file(path):
+    if os.path.exists(path):
         try:
-            with open('songs.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return SongTable.from_songs(iter_songs(path))
         except UnicodeDecodeError:
             # Fallback to Latin-1 which can handle all byte values
-            with open('songs.json', 'r', encoding='latin-1') as f:
-                return json.load(f)
+            return SongTable.from_songs(iter_songs(path, encoding='latin-1'))
     else:
         # Sample data if no file exists
         sample_songs = [
@@ -36,257 +53,180 @@ def load_songs():
             {"title": "Thriller", "artist": "Michael Jackson", "year": 1982},
         ]
 
-        # Create the songs.json file with sample data
-        with open('songs.json', 'w', encoding='utf-8') as f:
-            json.dump(sample_songs, f, ensure_ascii=False)
+        # Create the catalog file with sample data
+        write_songs(path, sample_songs)
 
-        return sample_songs
+        return SongTable.from_songs(sample_songs)
 
 
-# Load curated daily songs
-def load_curated_songs():
-    if os.path.exists('curated_songs.json'):
+# Read curated daily songs from disk
+def read_curated_file(path):
+    if os.path.exists(path):
         try:
-            with open('curated_songs.json', 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except UnicodeDecodeError:
             # Fallback to Latin-1 which can handle all byte values
-            with open('curated_songs.json', 'r', encoding='latin-1') as f:
+            with open(path, 'r', encoding='latin-1') as f:
                 return json.load(f)
     else:
         # Return empty dict if no curated songs exist
         return {}
 
 
-# Fetch
-def get_preview_url(title, artist):
-    """
-    Fetch a song preview URL from iTunes API with improved matching algorithm.
-    Uses multiple strategies to find the correct original version.
-    """
-    # Normalize artist name to handle featuring artists
-    primary_artist = artist.split('ft.')[0].split('feat.')[0].strip()
-    print(f"Searching iTunes for: '{title}' by '{primary_artist}'")
+# Songs, curated dates and resolved previews live in data files (admin writes go to journals)
+# or in a SQLite database, as chosen by STORAGE_BACKEND
+storage = storage_from_env(read_songs=read_songs_file, read_curated=read_curated_file)
 
-    # Strategy 1: Direct search with artist and title combined
-    combined_term = f"{title} {primary_artist}".replace(' ', '+')
-    url = f"https://itunes.apple.com/search?term={combined_term}&media=music&limit=25&entity=song"
+# Data is kept in memory and only re-read when it changes in storage (or on SIGHUP)
+song_catalog = ResidentCatalog(None, storage.load_songs, signature=storage.songs_signature, name='songs')
+curated_catalog = ResidentCatalog(None, storage.load_curated, signature=storage.curated_signature, name='curated')
+resolved_catalog = ResidentCatalog(None, storage.load_resolved_previews, signature=storage.resolved_signature,
+                                   name='resolved')
 
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code != 200:
-            print(f"iTunes API error: {response.status_code}")
-            return None
-
-        data = response.json()
-        results = data.get('results', [])
-
-        if not results:
-            print(f"No results found for combined search")
-        else:
-            print(f"Found {len(results)} results in combined search")
-
-            # Score and rank results
-            scored_results = []
-            for result in results:
-                score = 0
-
-                # Exact artist name match gets high score
-                if primary_artist.lower() == result['artistName'].lower():
-                    score += 100
-                # Partial artist match
-                elif primary_artist.lower() in result['artistName'].lower():
-                    score += 50
-                # No artist match
-                else:
-                    continue  # Skip completely different artists
-
-                # Exact title match
-                if title.lower() == result['trackName'].lower():
-                    score += 100
-                # Partial title match
-                elif title.lower() in result['trackName'].lower():
-                    score += 50
-                # Fuzzy title match (contains most words)
-                else:
-                    title_words = set(title.lower().split())
-                    track_words = set(result['trackName'].lower().split())
-                    common_words = title_words.intersection(track_words)
-                    if len(common_words) >= len(title_words) * 0.5:
-                        score += 25
-
-                # Boost original recordings and avoid covers/live versions
-                if 'cover' in result['trackName'].lower():
-                    score -= 50
-                if 'tribute' in result['trackName'].lower():
-                    score -= 50
-                if 'karaoke' in result['trackName'].lower():
-                    score -= 100
-                if 'live' in result['trackName'].lower():
-                    score -= 30
-                if 'acoustic' in result['trackName'].lower():
-                    score -= 20
-
-                # Favor higher popularity
-                if 'trackPopularity' in result:
-                    score += min(result['trackPopularity'] / 5, 20)
-
-                # Favor tracks from albums/EPs over singles
-                if result.get('collectionName'):
-                    if title.lower() in result['collectionName'].lower():
-                        score += 30
-                    else:
-                        score += 10
-
-                # Penalize instrumental, remix
-                if 'instrumental' in result['trackName'].lower():
-                    score -= 40
-                if 'remix' in result['trackName'].lower():
-                    score -= 30
-
-                # Log the candidate with its score
-                print(f"  Candidate: {result['trackName']} by {result['artistName']} - Score: {score}")
-
-                scored_results.append((score, result))
-
-            # Sort by score descending
-            scored_results.sort(reverse=True, key=lambda x: x[0])
-
-            # Return the preview URL of the highest scored result
-            if scored_results and scored_results[0][0] > 0:
-                best_match = scored_results[0][1]
-                print(
-                    f"Best match: {best_match['trackName']} by {best_match['artistName']} (Score: {scored_results[0][0]})")
-                return best_match['previewUrl']
-
-        # If we still haven't found a good match, try a more specific query
-        # Strategy 2: Try with exact artist search
-        print("Trying more specific artist search...")
-        artist_query = primary_artist.replace(' ', '+')
-        url = f"https://itunes.apple.com/search?term={title.replace(' ', '+')}&attribute=songTerm&media=music&entity=song&limit=10&artistTerm={artist_query}"
-
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get('results', [])
-
-            if results:
-                print(f"Found {len(results)} results in artist-specific search")
-
-                # Filter for exact title matches first
-                exact_matches = [r for r in results if title.lower() == r['trackName'].lower()]
-                if exact_matches:
-                    print(
-                        f"Found exact title match: {exact_matches[0]['trackName']} by {exact_matches[0]['artistName']}")
-                    return exact_matches[0]['previewUrl']
-
-                # Otherwise, return the first result
-                print(f"Using first result: {results[0]['trackName']} by {results[0]['artistName']}")
-                return results[0]['previewUrl']
-
-        # Still nothing? Try a third approach
-        # Strategy 3: Use collectionName to find the original album
-        print("Trying to find original album...")
-        url = f"https://itunes.apple.com/search?term={primary_artist.replace(' ', '+')}&entity=album&limit=10&media=music"
-
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            albums = data.get('results', [])
-
-            # Filter for studio albums
-            albums = [a for a in albums if
-                      a.get('collectionType') == 'Album' and 'live' not in a.get('collectionName', '').lower()]
-
-            if albums:
-                # Try to find songs from these albums
-                for album in albums[:3]:  # Try up to 3 top albums
-                    album_id = album['collectionId']
-                    url = f"https://itunes.apple.com/lookup?id={album_id}&entity=song"
-
-                    response = requests.get(url, timeout=10)
-                    if response.status_code == 200:
-                        data = response.json()
-                        songs = [r for r in data.get('results', []) if r.get('wrapperType') == 'track']
-
-                        # Look for our title in the tracks
-                        for song in songs:
-                            if title.lower() in song['trackName'].lower():
-                                print(f"Found in album '{album['collectionName']}': {song['trackName']}")
-                                return song['previewUrl']
-
-        print("All strategies failed to find a suitable match")
-        return None
-
-    except Exception as e:
-        print(f"Error fetching preview: {e}")
-        return None
-
-
-# Generate a unique daily seed based on date
-def get_daily_seed():
-    today = datetime.now().strftime('%Y-%m-%d')
-    return hash(today) % 1000000
 
+# Load song database (shared, treat as read-only)
+def load_songs():
+    return song_catalog.get()
 
-# Get the daily songs (either from curated list or randomly selected)
-def get_daily_songs():
-    curated_songs = load_curated_songs()
 
-    # Check if we have curated songs for today
-    today = datetime.now().strftime('%Y-%m-%d')
-    if today in curated_songs:
-        return curated_songs[today]
+# Load curated daily songs (shared, treat as read-only)
+def load_curated_songs():
+    return curated_catalog.get()
+
+
+# Get a preview URL, preferring ones resolved ahead of time by util/resolve_previews.py
+def lookup_preview_url(title, artist):
+    resolved = resolved_catalog.get()
+    key = preview_cache_key(title, artist)
+    if key in resolved:
+        return resolved[key]
+    return get_preview_url(title, artist)
+
+
+# Get a preview URL only if it's already known, without calling iTunes: (found, preview_url)
+def known_preview_url(title, artist):
+    key = preview_cache_key(title, artist)
+    resolved = resolved_catalog.get()
+    if key in resolved:
+        return True, resolved[key]
+    return preview_cache.peek(key)
+
+
+# Background lookups that resolve the previews of sessions' upcoming free-play rounds
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FREE_PREFETCH_WORKERS', 2)),
+    thread_name_prefix='prefetch'
+)
+PREFETCH_QUEUE = int(os.environ.get('FREE_PREFETCH_QUEUE', 64))
+# One future per song being looked up, shared by every session (and round) that wants it
+prefetch_pending = {}
+prefetch_lock = threading.Lock()
+
+
+# Resolve a song's preview in the background; returns its lookup's future, or None if too many are queued
+def prefetch_preview(song):
+    key = preview_cache_key(song['title'], song['artist'])
+    with prefetch_lock:
+        future = prefetch_pending.get(key)
+        if future is not None:
+            return future
+        if len(prefetch_pending) >= PREFETCH_QUEUE:
+            return None
+        future = prefetch_pending[key] = prefetch_executor.submit(lookup_preview_url, song['title'], song['artist'])
+
+    def finished(future):
+        with prefetch_lock:
+            prefetch_pending.pop(key, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Prefetch failed for '%s': %s", song['title'], future.exception())
+
+    future.add_done_callback(finished)
+    return future
+
+
+# Daily sets are computed once per date and warmed ahead of midnight
+daily_schedule = DailySchedule(
+    load_songs,
+    load_curated_songs,
+    lambda: (song_catalog.load_count, curated_catalog.load_count),
+    lookup_preview_url,
+    warm_ahead=int(os.environ.get('DAILY_WARM_AHEAD', 300))
+)
+
+
+# Start a daily game on today's songs (either from curated list or randomly selected).
+# Sessions store compact values: the date as a YYYYMMDD int and the songs as catalog IDs,
+# taken when the game starts so a catalog reload mid-game can't swap a round's song.
+def start_daily_songs():
+    daily_schedule.start()
+    today = datetime.now()
+    session['daily_date'] = int(today.strftime('%Y%m%d'))
+    session['daily_song_ids'] = daily_schedule.song_ids_for(today.strftime('%Y-%m-%d'))
+    return session['daily_song_ids']
+
+
+# Resolve the song ID stored in the session (a catalog index in both modes)
+def session_current_song():
+    song_id = session.get('song_id')
+    if song_id is None:
+        return {}
+    songs = load_songs()
+    if 0 <= song_id < len(songs):
+        return songs[song_id]
+    return {}
 
-    # No curated songs for today, generate 5 random ones
-    all_songs = load_songs()
 
-    # Make sure we have at least 5 songs, or repeat some if needed
-    if len(all_songs) < 5:
-        # If we have fewer than 5 songs, duplicate them to reach at least 5
-        all_songs = all_songs * (5 // len(all_songs) + 1)
+# Time every request by its route pattern (not the raw path, which would make a series per song or date)
+@routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-    # Use a consistent seed for the day so all players get the same songs
-    random.seed(get_daily_seed())
-    daily_selection = random.sample(all_songs, 5)  # Now we're guaranteed to have at least 5
-    random.seed()  # Reset the seed for other random operations
 
-    return daily_selection
+@routes.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method)
+        REQUESTS.inc(route=route, status=response.status_code)
+    return response
 
 
 # Main routes
-@app.route('/')
+@routes.route('/')
 def index():
     return render_template('index.html')
 
 
-@app.route('/daily')
+@routes.route('/daily')
 def daily_challenge():
     # Check if there's already a session for daily challenge
     if 'game_mode' in session and session['game_mode'] == 'daily':
         # Keep existing session data (don't reset current_round or score)
         current_round = session.get('current_round', 0)
         current_score = session.get('score', 100)
-        print(f"Resuming daily challenge at round {current_round} with score {current_score}")
+        logger.debug("Resuming daily challenge at round %s with score %s", current_round, current_score)
     else:
         # Initialize a new daily challenge
         session.clear()
         session['game_mode'] = 'daily'
         session['score'] = 100
         session['current_round'] = 0
-        print("Starting new daily challenge")
+        logger.debug("Starting new daily challenge")
 
-    # Get daily songs
-    daily_songs = get_daily_songs()
-    session['daily_songs'] = daily_songs
+    # Pick today's songs for a new game; a resumed game keeps the songs it started with
+    daily_schedule.start()
+    if 'daily_song_ids' not in session:
+        start_daily_songs()
 
     return render_template('daily.html')
 
 
-@app.route('/get_song_info', methods=['GET'])
+@routes.route('/get_song_info', methods=['GET'])
 def get_song_info():
     # Get the current song from the session
-    current_song = session.get('current_song', {})
+    current_song = session_current_song()
 
     if not current_song:
         return jsonify({"error": "No song information available"}), 404
@@ -299,7 +239,76 @@ def get_song_info():
     })
 
 
-@app.route('/free')
+# Walk this session's shuffle of the songs matching its free-play filters (None if nothing matches)
+def session_shuffle(songs):
+    matched = songs.filter_index().matching(
+        year_from=session.get('year_from'),
+        year_to=session.get('year_to'),
+        artist=session.get('artist')
+    )
+    if matched is None or matched[2] <= matched[1]:
+        return None
+    return ShuffledWalk(*matched, seed=session.get('shuffle_seed'), cursor=session.get('shuffle_cursor', 0))
+
+
+# Save the shuffle position back into the session (two integers, however long the game)
+def save_session_shuffle(shuffle):
+    session['shuffle_seed'] = shuffle.seed
+    session['shuffle_cursor'] = shuffle.cursor
+
+
+# Songs drawn from the shuffle ahead of time, so their previews resolve before their rounds
+FREE_LOOKAHEAD = int(os.environ.get('FREE_LOOKAHEAD', 4))
+# Seconds a free-play client waits before asking again when no song's preview is ready yet
+FREE_RETRY_AFTER = int(os.environ.get('FREE_RETRY_AFTER', 1))
+
+
+# Top the session's lookahead up from its shuffle, starting lookups for songs whose previews aren't known yet
+def fill_lookahead(songs, shuffle, queue):
+    while len(queue) < FREE_LOOKAHEAD:
+        song_id = shuffle.next()
+        if song_id in queue:
+            break  # Fewer songs match than the lookahead holds
+        queue.append(song_id)
+    for song_id in queue:
+        song = songs[song_id]
+        if not known_preview_url(song['title'], song['artist'])[0]:
+            prefetch_preview(song)
+    session['free_lookahead'] = queue
+
+
+# Take the next free-play round from the session's lookahead: the first song whose preview is already
+# known, skipping songs known to have none. Returns (song_id, preview_url), or None if no lookup has
+# finished yet; the round never waits on iTunes itself.
+def next_free_round(songs, shuffle):
+    queue = [song_id for song_id in session.get('free_lookahead', []) if song_id < len(songs)]
+    fill_lookahead(songs, shuffle, queue)
+
+    chosen, pending = None, []
+    for song_id in queue:
+        song = songs[song_id]
+        found, preview_url = known_preview_url(song['title'], song['artist'])
+        if found and not preview_url:
+            logger.debug("Skipping song without preview: %s by %s", song['title'], song['artist'])
+        elif found and chosen is None:
+            chosen = (song_id, preview_url)
+        else:
+            pending.append(song_id)
+
+    fill_lookahead(songs, shuffle, pending)
+    save_session_shuffle(shuffle)
+    return chosen
+
+
+# Parse an optional year query parameter
+def parse_year(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+@routes.route('/free')
 def free_play():
     # Initialize a new free play game
     session.clear()  # Clear any existing session
@@ -317,70 +326,100 @@ def free_play():
     session['unlimited_guesses'] = unlimited_guesses
     session['unlimited_mode'] = unlimited_mode
 
+    # Optional song filters (a decade is shorthand for a ten-year range)
+    year_from = parse_year(request.args.get('year_from'))
+    year_to = parse_year(request.args.get('year_to'))
+    decade = parse_year(request.args.get('decade'))
+    if decade is not None:
+        year_from, year_to = decade - decade % 10, decade - decade % 10 + 9
+    artist = request.args.get('artist', '').strip()
+    if year_from is not None:
+        session['year_from'] = year_from
+    if year_to is not None:
+        session['year_to'] = year_to
+    if artist:
+        session['artist'] = artist
+
+    # Start this game's shuffle and resolve the first rounds' previews
+    songs = load_songs()
+    shuffle = session_shuffle(songs)
+    if shuffle is not None:
+        fill_lookahead(songs, shuffle, [])
+        save_session_shuffle(shuffle)
+
     return render_template('free.html',
                           hints_enabled=hints_enabled,
                           unlimited_guesses=unlimited_guesses,
                           unlimited_mode=unlimited_mode)
 
 
-@app.route('/free_options')
+@routes.route('/free_options')
 def free_options():
-    return render_template('free_options.html')  # Note the underscore instead of hyphen
+    # Offer the decades that actually have songs
+    index = load_songs().filter_index()
+    decades = []
+    if index.years:
+        first_decade = index.years[0] - index.years[0] % 10
+        decades = [decade for decade in range(first_decade, index.years[-1] + 1, 10)
+                   if index.count(year_from=decade, year_to=decade + 9)]
+    return render_template('free_options.html', decades=decades)  # Note the underscore instead of hyphen
 
 
 # API endpoints
-@app.route('/get-song', methods=['GET'])
+@routes.route('/get-song', methods=['GET'])
 def get_song():
     try:
         # Get session data with defaults if missing
         game_mode = session.get('game_mode', 'free')
         current_round = session.get('current_round', 0)
 
-        print(f"GET /get-song - Mode: {game_mode}, Round: {current_round + 1}")
+        logger.debug("GET /get-song - Mode: %s, Round: %s", game_mode, current_round + 1)
 
         if game_mode == 'daily':
-            # Get song from pre-selected daily songs
-            daily_songs = session.get('daily_songs', [])
-
-            if not daily_songs:
-                print("Warning: No daily songs found in session. Generating new ones.")
-                # Fall back to random songs for daily mode
-                all_songs = load_songs()
-                if len(all_songs) < 5:
-                    all_songs = all_songs * (5 // len(all_songs) + 1)
-                daily_songs = random.sample(all_songs, 5)
-                session['daily_songs'] = daily_songs
-                print(f"Generated {len(daily_songs)} daily songs")
-
-            if current_round >= len(daily_songs) or current_round >= 5:
-                print(f"Game over. Final score: {session.get('score', 0)}")
-                return jsonify({"gameOver": True, "finalScore": session.get('score', 0)})
+            # Get song from the daily songs picked when this game started
+            daily_song_ids = session.get('daily_song_ids')
 
-            song = daily_songs[current_round]
-            print(f"Selected daily song: {song['title']} by {song['artist']}")
-        else:
-            # Free mode - get random song
-            songs = load_songs()
-            if not songs:
-                print("Error: No songs available for free mode")
-                return jsonify({"error": "No songs available"}), 400
+            if not daily_song_ids:
+                logger.warning("No daily songs found in session. Generating new ones.")
+                # Fall back to today's daily songs
+                daily_song_ids = start_daily_songs()
+                logger.debug("Generated %d daily songs", len(daily_song_ids))
 
-            song = random.choice(songs)
-            print(f"Selected random song: {song['title']} by {song['artist']}")
+            if current_round >= len(daily_song_ids) or current_round >= 5:
+                logger.debug("Game over. Final score: %s", session.get('score', 0))
+                return jsonify({"gameOver": True, "finalScore": session.get('score', 0)})
 
-        # Get preview URL from iTunes
-        preview_url = get_preview_url(song["title"], song["artist"])
-        if preview_url:
-            print(f"Found preview URL for song")
+            song_id = daily_song_ids[current_round]
+            song = load_songs()[song_id]
+            preview_url = None
+            logger.debug("Selected daily song: %s by %s", song['title'], song['artist'])
         else:
-            print(f"No preview URL found for song")
+            # Free mode - walk this session's shuffle so no song repeats until all have been played
+            songs = load_songs()
+            shuffle = session_shuffle(songs)
+            if shuffle is None:
+                logger.warning("No songs available for free mode")
+                has_filters = any(key in session for key in ('year_from', 'year_to', 'artist'))
+                return jsonify({"error": "No songs match these filters" if has_filters else "No songs available"}), 400
+
+            # Serve a song whose preview is already resolved; the next ones resolve while this round plays
+            chosen = next_free_round(songs, shuffle)
+            if chosen is None:
+                logger.debug("No free-play preview ready yet; asking the client to retry")
+                response = jsonify({"error": "Finding songs", "retry": True})
+                response.headers['Retry-After'] = str(FREE_RETRY_AFTER)
+                return response, 503
+            song_id, preview_url = chosen
+            song = songs[song_id]
+            logger.debug("Selected shuffled song: %s by %s", song['title'], song['artist'])
+
+        # Get preview URL from iTunes if we don't have one yet (free mode has already waited for its own)
+        if game_mode == 'daily' and not preview_url:
+            preview_url = lookup_preview_url(song["title"], song["artist"])
+        logger.debug("%s preview URL for song", "Found" if preview_url else "No")
 
         # Update session for this round
-        session['current_song'] = {
-            "title": song["title"],
-            "artist": song["artist"],
-            "year": song["year"]
-        }
+        session['song_id'] = song_id
 
         # Return song info with preview URL
         response_data = {
@@ -392,23 +431,22 @@ def get_song():
             "totalRounds": 5 if game_mode == 'daily' else "unlimited",
             "score": session.get('score', 100)
         }
-        print(f"Returning song data: {song['title']} (preview: {'available' if preview_url else 'not available'})")
+        logger.debug("Returning song data: %s (preview: %s)",
+                     song['title'], 'available' if preview_url else 'not available')
         return jsonify(response_data)
 
     except Exception as e:
-        print(f"Error in get_song: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_song: %s", e)
         # Try to recover by returning a safe response
         songs = load_songs()
         if songs:
             fallback_song = random.choice(songs)
-            print(f"Using fallback song: {fallback_song['title']}")
+            logger.warning("Using fallback song: %s", fallback_song['title'])
             return jsonify({
                 "title": None,
                 "artist": None,
                 "year": fallback_song["year"],
-                "previewUrl": get_preview_url(fallback_song["title"], fallback_song["artist"]),
+                "previewUrl": lookup_preview_url(fallback_song["title"], fallback_song["artist"]),
                 "round": 1,
                 "totalRounds": 5 if game_mode == 'daily' else "unlimited",
                 "score": 100,
@@ -421,7 +459,7 @@ def get_song():
             }), 500
 
 
-@app.route('/check-guess', methods=['POST'])
+@routes.route('/check-guess', methods=['POST'])
 def check_guess():
     try:
         data = request.get_json()
@@ -437,7 +475,7 @@ def check_guess():
         is_skip = data.get('is_skip', False)
 
         # Get the actual year from the session
-        current_song = session.get('current_song', {})
+        current_song = session_current_song()
         if not current_song:
             # Return a safe default response
             return jsonify({
@@ -454,7 +492,7 @@ def check_guess():
         score = session.get('score', 100)
 
         # Log the current state before changes
-        print(f"Before guess - Mode: {game_mode}, Round: {session.get('current_round', 0)}, Score: {score}")
+        logger.debug("Before guess - Mode: %s, Round: %s, Score: %s", game_mode, session.get('current_round', 0), score)
 
         # Apply the skip penalty (100 points) if this is a skip
         if is_skip:
@@ -475,20 +513,11 @@ def check_guess():
             # Check if game is over
             game_over = current_round >= 5
 
-            print(f"After guess - Round: {current_round}, Score: {new_score}, Game Over: {game_over}")
+            logger.debug("After guess - Round: %s, Score: %s, Game Over: %s", current_round, new_score, game_over)
 
             # Save guess history to session for the results copy feature
-            if 'guess_history' not in session:
-                session['guess_history'] = []
-
-            session['guess_history'].append({
-                'artist': current_song.get('artist', ''),
-                'title': current_song.get('title', ''),
-                'actual_year': actual_year,
-                'guessed_year': guess,
-                'year_difference': year_difference,
-                'is_skip': is_skip
-            })
+            # (signed guess - actual year per round, None for a skip)
+            session['guesses'] = session.get('guesses', []) + [None if is_skip else guess - actual_year]
 
             return jsonify({
                 "result": "correct" if year_difference == 0 else "incorrect",
@@ -543,7 +572,7 @@ def check_guess():
                     "next_round": False
                 })
     except Exception as e:
-        print(f"Error in check_guess: {e}")
+        logger.exception("Error in check_guess: %s", e)
         # Safe fallback response
         return jsonify({
             "error": "Failed to process guess",
@@ -558,7 +587,7 @@ def check_guess():
 
 
 # Admin endpoints
-@app.route('/add-curated-song', methods=['POST'])
+@routes.route('/add-curated-song', methods=['POST'])
 def add_curated_song():
     # This endpoint would be password protected in production
     data = request.get_json()
@@ -569,56 +598,159 @@ def add_curated_song():
     if not date or not songs:
         return jsonify({"error": "Missing required data"}), 400
 
-    curated_songs = load_curated_songs()
-    curated_songs[date] = songs
-
-    with open('curated_songs.json', 'w', encoding='utf-8') as f:
-        json.dump(curated_songs, f, ensure_ascii=False, indent=2)
+    storage.set_curated(date, songs)
+    curated_catalog.invalidate()
 
     return jsonify({"message": f"Added {len(songs)} songs for {date}"})
 
 
-@app.route('/add-song', methods=['POST'])
+@routes.route('/add-song', methods=['POST'])
 def add_song():
     # This endpoint would be password protected in production
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing required song data"}), 400
 
-    title = data.get('title')
-    artist = data.get('artist')
-    year = data.get('year')
+    # Same checks as a bulk import: required fields, year range and duplicates
+    new_songs, results = check_song_batch(load_songs(), [data])
+    if not new_songs:
+        return jsonify({"error": results[0]["error"]}), 400
 
-    if not title or not artist or not year:
-        return jsonify({"error": "Missing required song data"}), 400
+    # Add the new song (a duplicate racing in from another worker is dropped by the storage)
+    storage.add_songs(new_songs)
+    song_catalog.invalidate()
 
-    songs = load_songs()
+    return jsonify({"message": "Song added successfully"})
 
-    # Check for duplicates
-    for song in songs:
-        if song['title'].lower() == title.lower() and song['artist'].lower() == artist.lower():
-            return jsonify({"error": "Song already exists"}), 400
+@routes.route('/add-songs', methods=['POST'])
+def add_songs():
+    """Add a batch of songs in one write; reports what happened to each row."""
+    # This endpoint would be password protected in production
+    data = request.get_json(silent=True) or {}
+    rows = data.get('songs') if isinstance(data, dict) else data
 
-    # Add the new song
-    songs.append({
-        "title": title,
-        "artist": artist,
-        "year": int(year)
-    })
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        return jsonify({"error": "Expected a non-empty list of songs"}), 400
 
-    with open('songs.json', 'w', encoding='utf-8') as f:
-        json.dump(songs, f, ensure_ascii=False, indent=2)
+    new_songs, results = check_song_batch(load_songs(), rows)
+    if new_songs:
+        storage.add_songs(new_songs)
+        song_catalog.invalidate()
+
+    return jsonify({
+        "added": len(new_songs),
+        "skipped": len(rows) - len(new_songs),
+        "results": results
+    })
 
-    return jsonify({"message": "Song added successfully"})
 
-@app.route('/get-song-count', methods=['GET'])
+@routes.route('/get-song-count', methods=['GET'])
 def get_song_count():
     """Return the count of songs in the database."""
     songs = load_songs()
     count = int(len(songs))
     return jsonify({"count": count})
 
+
+@routes.route('/preview-cache-stats', methods=['GET'])
+def get_preview_cache_stats():
+    """Return hit/miss/eviction counters for the iTunes preview cache."""
+    return jsonify(preview_cache.stats())
+
+
+@routes.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Counters and latency histograms for this worker process, in the Prometheus text format."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@routes.route('/ready', methods=['GET'])
+def get_readiness():
+    """Readiness check: 200 once the catalogs are in memory and this worker's warm-up has run, 503 until then."""
+    warm_caches()
+    checks = {
+        "catalog_loaded": song_catalog.load_count > 0,
+        "curated_loaded": curated_catalog.load_count > 0,
+        "daily_warmed": bool(daily_schedule.warmed_dates)
+    }
+    ready = all(checks.values())
+    return jsonify({"ready": ready, "checks": checks}), 200 if ready else 503
+
+
+def config_from_env():
+    """App settings from the environment; see the README for what each one does."""
+    return {
+        "SECRET_KEY": os.environ.get('SECRET_KEY'),
+        "SESSION_BACKEND": os.environ.get('SESSION_BACKEND', 'memory'),
+        "SESSION_TTL": int(os.environ.get('SESSION_TTL', 2 * 24 * 60 * 60)),
+        "SESSION_DB": os.environ.get('SESSION_DB', 'sessions.db'),
+        "PRELOAD_CATALOG": os.environ.get('PRELOAD_CATALOG', 'true').lower() == 'true'
+    }
+
+
+def preload_catalogs():
+    """Parse the catalogs and build the free-play index now rather than on the first request."""
+    songs = load_songs()
+    songs.filter_index()
+    load_curated_songs()
+    resolved_catalog.get()
+    return len(songs)
+
+
+def warm_caches():
+    """
+    Start this process's daily warm-up, which resolves the previews of today's
+    songs (and tomorrow's, just before midnight). It runs on threads, so call it
+    in each worker after fork, never in a gunicorn master. Safe to call repeatedly.
+    """
+    daily_schedule.start()
+
+
+def install_catalog_reload():
+    """
+    Re-read the catalogs when this process receives SIGHUP. Under gunicorn,
+    call it in each worker once the worker has set up its own signal handlers
+    (which reset SIGHUP to the default, terminating the worker).
+    """
+    return install_reload_signal(song_catalog, curated_catalog, resolved_catalog)
+
+
+def create_app(config=None):
+    """
+    Build the app with settings from the environment, overridden by `config`.
+    Under gunicorn (see gunicorn.conf.py) this runs once in the master, so the
+    preloaded catalogs are shared copy-on-write by every worker. It must not
+    start threads or make network calls, since neither survives a fork.
+    """
+    app = Flask(__name__, static_folder='static', static_url_path='/static')
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+
+    if not app.config['SECRET_KEY']:
+        # Only signed-cookie sessions depend on it; they wouldn't survive a restart with a random key
+        if app.config['SESSION_BACKEND'] == 'cookie':
+            logger.warning("SECRET_KEY is not set; using a random key")
+        app.config['SECRET_KEY'] = os.urandom(24)
+
+    # Keep game state server-side; the cookie only carries a session ID
+    session_store = create_session_store(
+        app.config['SESSION_BACKEND'],
+        ttl=app.config['SESSION_TTL'],
+        db_path=app.config['SESSION_DB']
+    )
+    if session_store is not None:
+        app.session_interface = ServerSideSessionInterface(session_store)
+
+    app.register_blueprint(routes)
+
+    if app.config['PRELOAD_CATALOG']:
+        logger.info("Preloaded %d songs", preload_catalogs())
+    return app
+
+
 if __name__ == '__main__':
-    # For local development
+    # For local development; production runs under gunicorn with gunicorn.conf.py
+    app = create_app()
+    install_catalog_reload()
+    warm_caches()
     app.run(debug=True)
-else:
-    # For production on Render
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,637 @@
+# catalog.py
+
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Sequence
+
+import metrics
+from journal import JournaledFile
+from matching import PUNCTUATION_RE
+
+logger = logging.getLogger(__name__)
+
+
+# The song catalog, as a legacy JSON array (.json) or one song per line (.ndjson/.jsonl)
+SONGS_FILE = os.environ.get('SONGS_FILE', 'songs.json')
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+CURATED_FILE = 'curated_songs.json'
+
+# Years a song may have (SongTable stores them as unsigned 16-bit values)
+MIN_YEAR = 1000
+MAX_YEAR = 9999
+
+CATALOG_LOAD_SECONDS = metrics.histogram(
+    'yearworm_catalog_load_seconds', "Time to (re)load a resident catalog from storage.", ['catalog'])
+
+
+def check_year(year):
+    """Return a song's year as an int, raising ValueError if it isn't a number in MIN_YEAR..MAX_YEAR."""
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        raise ValueError(f"Year must be a number, not {year!r}")
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"Year must be between {MIN_YEAR} and {MAX_YEAR}, not {year}")
+    return year
+
+
+def is_ndjson(path):
+    """Whether a catalog file holds one song per line rather than a single JSON array."""
+    return os.path.splitext(path)[1].lower() in NDJSON_EXTENSIONS
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """
+    Incrementally parse a file holding one JSON array of objects, yielding each
+    element as soon as it has been read, so the whole array is never in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    eof = not buffer
+    position = len(buffer) - len(buffer.lstrip())
+    if buffer[position:position + 1] != '[':
+        raise ValueError(f"{getattr(f, 'name', 'catalog')}: expected a JSON array")
+    position += 1
+
+    while True:
+        # Skip separators between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if complete:
+            yield item
+            position = end
+            continue
+
+        # The next element runs past the buffer: drop what's been parsed and read more
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        if eof and position >= len(buffer):
+            raise ValueError(f"{getattr(f, 'name', 'catalog')}: unterminated JSON array")
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_songs(path, encoding='utf-8'):
+    """
+    Yield the songs of a catalog file one at a time, without loading the whole
+    file: line-delimited catalogs are parsed a line at a time, and legacy array
+    catalogs element by element.
+    """
+    with open(path, 'r', encoding=encoding) as f:
+        if not is_ndjson(path):
+            yield from iter_json_array(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid song line: {e}") from e
+
+
+def write_songs(path, songs):
+    """Write a whole catalog atomically, in the format given by the path's extension."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if is_ndjson(path):
+            for song in songs:
+                f.write(json.dumps(song, ensure_ascii=False) + '\n')
+        else:
+            json.dump(list(songs), f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def append_songs(path, songs):
+    """
+    Add songs to the end of a catalog file. Line-delimited catalogs are
+    appended to in place; legacy array catalogs have to be rewritten.
+    """
+    if not is_ndjson(path):
+        existing = list(iter_songs(path)) if os.path.exists(path) else []
+        write_songs(path, existing + list(songs))
+        return
+
+    data = ''.join(json.dumps(song, ensure_ascii=False) + '\n' for song in songs).encode('utf-8')
+    with open(path, 'ab+') as f:
+        # Don't glue the first new song onto a last line missing its newline
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                data = b'\n' + data
+        f.write(data)
+
+
+def read_song_table(path):
+    """Load a catalog file into a SongTable (empty if the file doesn't exist)."""
+    if not os.path.exists(path):
+        return SongTable()
+    return SongTable.from_songs(iter_songs(path))
+
+
+def replay_added_songs(table, entries):
+    """Apply 'add' journal entries to a SongTable, skipping songs it already has or can't hold."""
+    added = set()
+    new_songs = []
+    # Check everything against the snapshot first, so its key index is only built once
+    for entry in entries:
+        song = entry['song']
+        try:
+            check_year(song['year'])
+        except ValueError as e:
+            # Written before years were validated; one bad entry mustn't stop the catalog loading
+            logger.warning("Skipping journaled song '%s' by %s: %s", song['title'], song['artist'], e)
+            continue
+        key = song_key(song['title'], song['artist'])
+        if key not in added and table.find(song['title'], song['artist']) is None:
+            added.add(key)
+            new_songs.append(song)
+    for song in new_songs:
+        table.append(song['title'], song['artist'], song['year'])
+
+
+def check_song_batch(table, rows):
+    """
+    Validate rows of {"title", "artist", "year"} for a bulk import.
+    Duplicates are found with the table's hash index plus a set of the batch's
+    own keys, so checking n rows costs O(n log catalog) however big the
+    catalog is. Returns (new_songs, results) with one result per row.
+    """
+    new_songs = []
+    results = []
+    batch_keys = set()
+    for row_number, row in enumerate(rows):
+        title = str(row.get('title') or '').strip()
+        artist = str(row.get('artist') or '').strip()
+        year = row.get('year')
+
+        if not title or not artist or year in (None, ''):
+            results.append({"row": row_number, "status": "invalid", "error": "Missing required song data"})
+            continue
+        try:
+            year = check_year(year)
+        except ValueError as e:
+            results.append({"row": row_number, "status": "invalid", "error": str(e)})
+            continue
+
+        key = song_key(title, artist)
+        if key in batch_keys or table.find(title, artist) is not None:
+            results.append({"row": row_number, "status": "duplicate", "error": "Song already exists"})
+            continue
+
+        batch_keys.add(key)
+        new_songs.append({"title": title, "artist": artist, "year": year})
+        results.append({"row": row_number, "status": "added"})
+    return new_songs, results
+
+
+def song_journal(path=SONGS_FILE, read_snapshot=read_song_table):
+    """The journaled song catalog: added songs are journaled as {"op": "add", "song": {...}}."""
+    return JournaledFile(path, read_snapshot, write_songs, replay_added_songs,
+                         compact_bytes=int(os.environ.get('JOURNAL_COMPACT_BYTES', 256 * 1024)))
+
+
+def read_curated_songs(path):
+    """Load the curated daily songs file (empty if it doesn't exist)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_curated_songs(path, curated_songs):
+    """Write the curated daily songs atomically."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(curated_songs, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def replay_curated_dates(curated_songs, entries):
+    """Apply 'set' journal entries; the latest entry for a date wins."""
+    for entry in entries:
+        curated_songs[entry['date']] = entry['songs']
+
+
+def curated_journal(path=CURATED_FILE, read_snapshot=read_curated_songs):
+    """The journaled curated songs: dates are journaled as {"op": "set", "date": ..., "songs": [...]}."""
+    return JournaledFile(path, read_snapshot, write_curated_songs, replay_curated_dates,
+                         compact_bytes=int(os.environ.get('JOURNAL_COMPACT_BYTES', 256 * 1024)))
+
+
+def primary_artist_name(artist):
+    """Strip featured artists so 'A ft. B' and 'A feat. C' both become 'A'."""
+    return artist.split('ft.')[0].split('feat.')[0].strip()
+
+
+def artist_filter_key(artist):
+    """Normalized primary artist used by the artist filter."""
+    return ' '.join(primary_artist_name(artist).lower().split())
+
+
+def song_key(title, artist):
+    """Case-insensitive identity of a song, used for duplicate checks."""
+    return f"{title.lower()}|{artist.lower()}"
+
+
+class SongTable(Sequence):
+    """
+    Compact column-oriented song catalog with integer song IDs.
+    Each song's ID is its row number, which stays stable as long as the catalog
+    is only appended to. Titles live in one UTF-8 string table, artists are
+    interned once and referenced by index, and years sit in an unsigned 16-bit
+    array, so memory stays small and linear at millions of songs.
+
+    Indexing and iteration return plain {"title", "artist", "year"} dicts, so
+    code written against the old list of dicts keeps working.
+    """
+
+    def __init__(self):
+        self._title_data = bytearray()
+        self._title_offsets = array('Q', [0])
+        self._artist_ids = array('L')
+        self._years = array('H')
+        self.artists = []
+        self._artist_lookup = {}
+        self._key_hashes = None
+        self._key_ids = None
+        self._filter_index = None
+        self._search_index = None
+
+    @classmethod
+    def from_songs(cls, songs):
+        table = cls()
+        for song in songs:
+            table.append(song['title'], song['artist'], song['year'])
+        return table
+
+    def append(self, title, artist, year):
+        """Add a song and return its ID; raises ValueError (adding nothing) if the year can't be stored."""
+        year = check_year(year)
+        song_id = len(self._years)
+        self._title_data += title.encode('utf-8')
+        self._title_offsets.append(len(self._title_data))
+
+        artist_id = self._artist_lookup.get(artist)
+        if artist_id is None:
+            artist_id = len(self.artists)
+            self.artists.append(sys.intern(artist))
+            self._artist_lookup[artist] = artist_id
+        self._artist_ids.append(artist_id)
+        self._years.append(year)
+
+        # Indexes are rebuilt lazily on the next lookup, except search which is updated in place
+        self._key_hashes = None
+        self._filter_index = None
+        if self._search_index is not None:
+            self._search_index.add(song_id)
+        return song_id
+
+    def __len__(self):
+        return len(self._years)
+
+    def __getitem__(self, song_id):
+        if isinstance(song_id, slice):
+            return [self[i] for i in range(*song_id.indices(len(self)))]
+        if song_id < 0:
+            song_id += len(self)
+        if not 0 <= song_id < len(self):
+            raise IndexError("song ID out of range")
+        return {"title": self.title(song_id), "artist": self.artist(song_id), "year": self._years[song_id]}
+
+    def title(self, song_id):
+        start, end = self._title_offsets[song_id], self._title_offsets[song_id + 1]
+        return self._title_data[start:end].decode('utf-8')
+
+    def artist(self, song_id):
+        return self.artists[self._artist_ids[song_id]]
+
+    def artist_id(self, song_id):
+        return self._artist_ids[song_id]
+
+    def year(self, song_id):
+        return self._years[song_id]
+
+    def _build_key_index(self):
+        # Sorted (hash, ID) columns: 16 bytes per song instead of a dict of strings
+        pairs = sorted((hash(song_key(self.title(i), self.artist(i))), i) for i in range(len(self)))
+        self._key_ids = array('L', [song_id for _, song_id in pairs])
+        self._key_hashes = array('q', [key_hash for key_hash, _ in pairs])
+
+    def find(self, title, artist):
+        """Return the ID of the song matching title and artist (case-insensitive), or None."""
+        if self._key_hashes is None:
+            self._build_key_index()
+        key = song_key(title, artist)
+        key_hash = hash(key)
+        position = bisect_left(self._key_hashes, key_hash)
+        while position < len(self._key_hashes) and self._key_hashes[position] == key_hash:
+            song_id = self._key_ids[position]
+            if song_key(self.title(song_id), self.artist(song_id)) == key:
+                return song_id
+            position += 1
+        return None
+
+    def filter_index(self):
+        """Return the (lazily built) SongFilterIndex for this table."""
+        index = self._filter_index
+        if index is None:
+            index = self._filter_index = SongFilterIndex(self)
+        return index
+
+    def search_index(self):
+        """Return the (lazily built) SongSearchIndex for this table."""
+        index = self._search_index
+        if index is None:
+            index = self._search_index = SongSearchIndex(self)
+        return index
+
+
+class SongFilterIndex:
+    """
+    Precomputed ID buckets for filtered free play.
+    Song IDs are kept sorted by year, and separately sorted by (artist, year) with
+    prefix counts marking where each artist's bucket starts. Every filter then
+    maps to one contiguous slice (or a few, for artists credited several ways)
+    found by binary search, so a uniformly random match is picked in O(log n)
+    whatever the catalog size.
+    """
+
+    def __init__(self, table):
+        by_year = sorted(range(len(table)), key=table.year)
+        self.year_ids = array('L', by_year)
+        self.years = array('H', [table.year(song_id) for song_id in by_year])
+
+        # Group artist credits by normalized primary artist ("Queen" and "Queen ft. X" share a bucket)
+        self.artist_groups = {}
+        group_of_artist = [self.artist_groups.setdefault(artist_filter_key(artist), len(self.artist_groups))
+                           for artist in table.artists]
+        by_artist = sorted(range(len(table)),
+                           key=lambda song_id: (group_of_artist[table.artist_id(song_id)], table.year(song_id)))
+        self.artist_ids = array('L', by_artist)
+        self.artist_years = array('H', [table.year(song_id) for song_id in by_artist])
+
+        # Prefix counts: group g occupies artist_ids[group_starts[g]:group_starts[g + 1]]
+        counts = [0] * len(self.artist_groups)
+        for artist_id in table._artist_ids:
+            counts[group_of_artist[artist_id]] += 1
+        self.group_starts = array('L', [0])
+        for count in counts:
+            self.group_starts.append(self.group_starts[-1] + count)
+
+    def matching(self, year_from=None, year_to=None, artist=None):
+        """Return (ids, start, end) for the songs matching the filter, or None if the artist is unknown."""
+        year_from = 0 if year_from is None else year_from
+        year_to = 65535 if year_to is None else year_to
+        if artist is None:
+            start = bisect_left(self.years, year_from)
+            end = bisect_right(self.years, year_to)
+            return self.year_ids, start, end
+
+        group = self.artist_groups.get(artist_filter_key(artist))
+        if group is None:
+            return None
+        lo, hi = self.group_starts[group], self.group_starts[group + 1]
+        start = bisect_left(self.artist_years, year_from, lo, hi)
+        end = bisect_right(self.artist_years, year_to, lo, hi)
+        return self.artist_ids, start, end
+
+    def count(self, year_from=None, year_to=None, artist=None):
+        """Number of songs matching the filter."""
+        matched = self.matching(year_from, year_to, artist)
+        if matched is None:
+            return 0
+        _, start, end = matched
+        return max(end - start, 0)
+
+    def sample(self, rng, year_from=None, year_to=None, artist=None):
+        """Return the ID of a uniformly random song matching the filter, or None if nothing matches."""
+        matched = self.matching(year_from, year_to, artist)
+        if matched is None:
+            return None
+        ids, start, end = matched
+        if end <= start:
+            return None
+        return ids[rng.randrange(start, end)]
+
+
+def search_text(text):
+    """Lowercase text with punctuation dropped and whitespace collapsed, as used for search."""
+    return ' '.join(PUNCTUATION_RE.sub('', text.lower()).split())
+
+
+class SongSearchIndex:
+    """
+    Trigram and word-prefix index over normalized titles and artists.
+    Queries of three or more characters intersect the posting lists of their
+    trigrams (shortest first) and only verify the few songs left; shorter
+    queries match word prefixes through a sorted word list. Posting lists are
+    arrays of song IDs in ascending order, and songs appended to the table are
+    added in place, so the index never has to be rebuilt.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.trigrams = {}
+        self.word_ids = {}
+        # Normalized titles in one string table like SongTable's, and normalized artists by artist ID
+        self._title_data = bytearray()
+        self._title_offsets = array('Q', [0])
+        self._artists = []
+        for song_id in range(len(table)):
+            self._index(song_id)
+        self.words = sorted(self.word_ids)
+
+    def _title(self, song_id):
+        start, end = self._title_offsets[song_id], self._title_offsets[song_id + 1]
+        return self._title_data[start:end].decode('utf-8')
+
+    def _artist(self, song_id):
+        return self._artists[self.table.artist_id(song_id)]
+
+    def _index(self, song_id):
+        title = search_text(self.table.title(song_id))
+        self._title_data += title.encode('utf-8')
+        self._title_offsets.append(len(self._title_data))
+        while len(self._artists) < len(self.table.artists):
+            self._artists.append(search_text(self.table.artists[len(self._artists)]))
+        artist = self._artist(song_id)
+        new_words = []
+        for gram in {text[i:i + 3] for text in (title, artist) for i in range(len(text) - 2)}:
+            ids = self.trigrams.get(gram)
+            if ids is None:
+                ids = self.trigrams[gram] = array('L')
+            ids.append(song_id)
+        for word in set(title.split()) | set(artist.split()):
+            ids = self.word_ids.get(word)
+            if ids is None:
+                ids = self.word_ids[word] = array('L')
+                new_words.append(word)
+            ids.append(song_id)
+        return new_words
+
+    def add(self, song_id):
+        """Index a song that was just appended to the table."""
+        for word in self._index(song_id):
+            insort(self.words, word)
+
+    def _candidates(self, query):
+        if len(query) < 3:
+            # Songs with a word starting with the query
+            start = bisect_left(self.words, query)
+            end = bisect_left(self.words, query + '\uffff')
+            return set().union(*(self.word_ids[word] for word in self.words[start:end]))
+
+        postings = []
+        for gram in {query[i:i + 3] for i in range(len(query) - 2)}:
+            ids = self.trigrams.get(gram)
+            if ids is None:
+                return set()
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        # A couple of intersections narrow things down enough; the substring check does the rest
+        for ids in postings[1:3]:
+            candidates.intersection_update(ids)
+        return candidates
+
+    @staticmethod
+    def _rank(query, title, artist):
+        if title == query:
+            return 0
+        if title.startswith(query):
+            return 1
+        if any(word.startswith(query) for word in title.split()):
+            return 2
+        if artist.startswith(query):
+            return 3
+        if any(word.startswith(query) for word in artist.split()):
+            return 4
+        return 5 if query in title else 6
+
+    def search(self, query, limit=None):
+        """Return the IDs of the songs whose title or artist contains the query, best matches first."""
+        query = search_text(query)
+        if not query:
+            return []
+
+        ranked = []
+        for song_id in self._candidates(query):
+            title, artist = self._title(song_id), self._artist(song_id)
+            if len(query) < 3 or query in title or query in artist:
+                ranked.append((self._rank(query, title, artist), len(title), song_id))
+        ranked.sort()
+        if limit is not None:
+            del ranked[limit:]
+        return [song_id for _, _, song_id in ranked]
+
+
+def file_signature(*paths):
+    """(mtime, size) of each file, or None for files that don't exist; changes whenever a file does."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ResidentCatalog:
+    """
+    Keeps the parsed contents of a data file resident in memory.
+    The file is parsed once and served from memory afterwards; it is only
+    re-parsed when its mtime or size changes, or after invalidate() is called
+    (e.g. from a SIGHUP handler). Reloads build the new data completely before
+    swapping it in, so readers never see a half-loaded catalog.
+
+    Callers must treat the returned data as read-only and copy it before
+    making changes.
+
+    Data that doesn't come from a single file can pass `signature`, a
+    callable returning a value that changes whenever the data does (such as
+    a database version counter); `path` is then None and the loader is
+    called without arguments. Loads are timed under `name` (default: the path).
+    """
+
+    def __init__(self, path, loader, check_interval=1.0, signature=None, name=None):
+        self.path = path
+        self.name = name or path
+        self.signature = signature
+        self.loader = loader
+        self.check_interval = check_interval
+        self.load_count = 0
+        self._lock = threading.Lock()
+        self._data = None
+        self._last_signature = None
+        self._checked_at = 0.0
+        self._stale = True
+
+    def _signature(self):
+        if self.signature is not None:
+            return self.signature()
+        return file_signature(self.path)
+
+    def get(self):
+        """Return the current data, reloading it first if the file has changed."""
+        now = time.monotonic()
+        if not self._stale and now - self._checked_at < self.check_interval:
+            return self._data
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if not self._stale and now - self._checked_at < self.check_interval:
+                return self._data
+
+            signature = self._signature()
+            if self._stale or signature != self._last_signature:
+                with CATALOG_LOAD_SECONDS.time(catalog=self.name):
+                    data = self.loader() if self.path is None else self.loader(self.path)
+                self._data = data
+                self._last_signature = signature
+                self._stale = False
+                self.load_count += 1
+            self._checked_at = now
+
+        return self._data
+
+    def invalidate(self):
+        """Force a reload on the next read."""
+        self._stale = True
+
+
+def install_reload_signal(*catalogs):
+    """Invalidate the given catalogs whenever the process receives SIGHUP."""
+    if not hasattr(signal, 'SIGHUP'):
+        # Not available on Windows
+        return False
+
+    def handle_sighup(signum, frame):
+        for catalog in catalogs:
+            catalog.invalidate()
+
+    try:
+        signal.signal(signal.SIGHUP, handle_sighup)
+    except ValueError:
+        # Signal handlers can only be installed from the main thread
+        return False
+    return True
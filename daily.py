@@ -0,0 +1,135 @@
+# daily.py
+
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DAILY_ROUNDS = 5
+
+DAILY_SELECTION_SECONDS = metrics.histogram(
+    'yearworm_daily_selection_seconds', "Time to pick a date's daily songs when they aren't memoized yet.")
+
+
+def daily_seed(date_str):
+    """
+    Stable seed for a date. Unlike hash(), this doesn't depend on PYTHONHASHSEED,
+    so every worker and every node picks the same daily songs.
+    """
+    digest = hashlib.sha256(f"yearworm-daily:{date_str}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+def pick_daily_songs(date_str, curated_songs, all_songs):
+    """Return the curated songs for a date, or a deterministic random pick from the catalog."""
+    if date_str in curated_songs:
+        return curated_songs[date_str]
+
+    if not all_songs:
+        return []
+
+    # Make sure we have at least 5 songs, or repeat some if needed
+    if len(all_songs) < DAILY_ROUNDS:
+        all_songs = list(all_songs) * (DAILY_ROUNDS // len(all_songs) + 1)
+
+    # A private RNG keeps the global random state (used by free play) untouched
+    rng = random.Random(daily_seed(date_str))
+    return rng.sample(all_songs, DAILY_ROUNDS)
+
+
+class DailySchedule:
+    """
+    Memoized daily song sets, plus a background job that computes tomorrow's
+    set and resolves its previews shortly before midnight so the rollover rush
+    hits a warm cache. `catalog_version` returns a value that changes whenever
+    either catalog is reloaded (such as their load counts), so sets are
+    recomputed from the new data.
+    """
+
+    def __init__(self, load_songs, load_curated_songs, catalog_version, resolve_preview, warm_ahead=300):
+        self.load_songs = load_songs
+        self.load_curated_songs = load_curated_songs
+        self.catalog_version = catalog_version
+        self.resolve_preview = resolve_preview
+        self.warm_ahead = warm_ahead
+        self.warmed_dates = []
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def songs_for(self, date_str):
+        version = self.catalog_version()
+        curated_songs = self.load_curated_songs()
+        all_songs = self.load_songs()
+        key = (date_str, version)
+        # If a catalog reloaded while we read it, compute from what we got but don't memoize it
+        settled = self.catalog_version() == version
+        with self._lock:
+            songs = self._memo.get(key) if settled else None
+        if songs is not None:
+            return songs
+
+        with DAILY_SELECTION_SECONDS.time():
+            songs = pick_daily_songs(date_str, curated_songs, all_songs)
+        if not settled:
+            return songs
+        with self._lock:
+            # Only today and tomorrow are ever needed
+            if len(self._memo) >= 4:
+                self._memo.clear()
+            self._memo[key] = songs
+        return songs
+
+    def song_ids_for(self, date_str):
+        """
+        Catalog IDs of a date's songs, which keep pointing at the same songs when
+        the catalog reloads. Curated songs that aren't in the catalog are left out.
+        """
+        all_songs = self.load_songs()
+        song_ids = []
+        for song in self.songs_for(date_str):
+            song_id = all_songs.find(song['title'], song['artist'])
+            if song_id is None:
+                logger.warning("Daily song for %s isn't in the catalog: %s by %s", date_str, song['title'], song['artist'])
+            else:
+                song_ids.append(song_id)
+        return song_ids
+
+    def warm(self, date_str):
+        """Compute the set for a date and resolve its preview URLs."""
+        songs = self.songs_for(date_str)
+        for song in songs:
+            try:
+                self.resolve_preview(song['title'], song['artist'])
+            except Exception as e:
+                logger.warning("Failed to warm preview for '%s': %s", song['title'], e)
+        self.warmed_dates.append(date_str)
+        del self.warmed_dates[:-7]
+        logger.info("Warmed daily songs for %s", date_str)
+
+    def start(self):
+        """Start the warm-up job for this process (forked workers need their own thread)."""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+        threading.Thread(target=self._warm_loop, name='daily-warmer', daemon=True).start()
+
+    def _warm_loop(self):
+        self.warm(datetime.now().strftime('%Y-%m-%d'))
+        while True:
+            now = datetime.now()
+            tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            wake_at = tomorrow - timedelta(seconds=self.warm_ahead)
+            if wake_at > now:
+                time.sleep((wake_at - now).total_seconds())
+            self.warm(tomorrow.strftime('%Y-%m-%d'))
+            # Don't warm the same day twice
+            time.sleep(max((tomorrow - datetime.now()).total_seconds(), 0) + 1)
@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+# Production server settings; start with `gunicorn` from the project directory.
+
+import gc
+import os
+
+wsgi_app = 'app:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Each worker runs several request threads, so a slow iTunes lookup doesn't block the others
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+# Build the app (and parse the catalogs) once in the master; workers inherit it copy-on-write
+preload_app = True
+
+
+def on_starting(server):
+    if server.cfg.workers > 1 and os.environ.get('SESSION_BACKEND', 'memory') == 'memory':
+        server.log.warning("SESSION_BACKEND=memory keeps sessions inside one worker; "
+                           "set SESSION_BACKEND=sqlite when running more than one")
+
+
+def when_ready(server):
+    # The preloaded catalogs live as long as the master. Freezing them keeps the
+    # garbage collector from touching (and so copying) their pages in every worker.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # The worker has just reset its signals, so SIGHUP can now re-read this worker's catalogs
+    # (in the master it still restarts the workers)
+    from app import install_catalog_reload, warm_caches
+    install_catalog_reload()
+    # Threads don't survive fork, so each worker starts its own warm-up
+    warm_caches()
@@ -0,0 +1,519 @@
+# itunes.py
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from catalog import artist_filter_key, primary_artist_name
+from matching import SongQuery, score_candidates
+
+logger = logging.getLogger(__name__)
+
+ITUNES_REQUESTS = metrics.counter(
+    'yearworm_itunes_requests_total',
+    "iTunes HTTP requests by outcome: the status code, timeout or connection_error.", ['outcome'])
+ITUNES_RETRIES = metrics.counter('yearworm_itunes_retries_total', "iTunes HTTP requests retried after an error.")
+ITUNES_REQUEST_SECONDS = metrics.histogram(
+    'yearworm_itunes_request_seconds', "Duration of each iTunes HTTP request (retries are timed separately).")
+STRATEGY_SECONDS = metrics.histogram(
+    'yearworm_itunes_strategy_seconds', "Duration of each iTunes search strategy.", ['strategy'])
+STRATEGY_RESULTS = metrics.counter(
+    'yearworm_itunes_strategy_results_total',
+    "Search strategy outcomes: good match, fallback candidate, miss or error.", ['strategy', 'result'])
+LOOKUP_SECONDS = metrics.histogram(
+    'yearworm_itunes_lookup_seconds', "Duration of a whole preview lookup across all strategies.")
+LOOKUPS = metrics.counter(
+    'yearworm_itunes_lookups_total',
+    "Preview lookups by the strategy whose track was used (none, timeout or error otherwise).", ['strategy'])
+
+
+def preview_cache_key(title, artist):
+    """Normalized (title, primary artist) key used to cache preview lookups."""
+    return ' '.join(title.lower().split()), artist_filter_key(artist)
+
+
+class ITunesError(Exception):
+    """Raised when the iTunes API answers with an error status."""
+
+
+class LookupTimeout(ITunesError):
+    """Raised when a lookup's deadline passes before its strategies have answered."""
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `rate` calls start per second, across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Optional global limiter shared by every iTunes call (set by bulk tools)
+rate_limiter = None
+
+
+def parse_retry_after(response):
+    """Return the Retry-After header of a response in seconds, or None if absent or unparseable."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class ITunesClient:
+    """
+    Pooled keep-alive HTTP client for the iTunes API.
+    Connections are reused across lookups instead of paying a new TCP+TLS
+    handshake per call. Rate limiting and transient errors (403/429/5xx,
+    connection errors, timeouts) are retried with jittered exponential
+    backoff, honoring Retry-After when the server sends one.
+    """
+
+    RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size=8, timeout=10, max_retries=2, backoff_base=0.5, backoff_max=8.0):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests_sent = 0
+        self.retries = 0
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        """Return this process's session; forked workers (e.g. gunicorn) each build their own pool."""
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def backoff_delay(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        retry_after = parse_retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # "Full jitter" so workers that failed together don't retry together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get(self, url):
+        attempt = 0
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            self.requests_sent += 1
+            try:
+                with ITUNES_REQUEST_SECONDS.time():
+                    response = self.session().get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                ITUNES_REQUESTS.inc(outcome='timeout' if isinstance(e, requests.Timeout) else 'connection_error')
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning("iTunes request failed (%s), retrying in %.1fs", e, delay)
+            else:
+                ITUNES_REQUESTS.inc(outcome=response.status_code)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self.backoff_delay(attempt, response)
+                logger.warning("iTunes API error: %s, retrying in %.1fs", response.status_code, delay)
+                response.close()
+            attempt += 1
+            self.retries += 1
+            ITUNES_RETRIES.inc()
+            time.sleep(delay)
+
+
+itunes_client = ITunesClient(
+    pool_size=int(os.environ.get('ITUNES_POOL_SIZE', os.environ.get('ITUNES_MAX_CONCURRENCY', 8))),
+    timeout=float(os.environ.get('ITUNES_TIMEOUT', 10)),
+    max_retries=int(os.environ.get('ITUNES_MAX_RETRIES', 2)),
+    backoff_base=float(os.environ.get('ITUNES_BACKOFF_BASE', 0.5)),
+    backoff_max=float(os.environ.get('ITUNES_BACKOFF_MAX', 8))
+)
+
+
+def itunes_get(url):
+    """GET an iTunes API URL through the shared pooled client."""
+    return itunes_client.get(url)
+
+
+# Strategies run on this pool so one slow iTunes call doesn't hold up the others
+strategy_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ITUNES_MAX_CONCURRENCY', 8)),
+    thread_name_prefix='itunes'
+)
+# The album search waits on its album lookups, so they get their own pool: queued behind
+# album searches on strategy_executor, they'd never start
+album_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ITUNES_MAX_CONCURRENCY', 8)),
+    thread_name_prefix='itunes-album'
+)
+
+# Overall time budget for one lookup across all strategies, in seconds
+LOOKUP_DEADLINE = float(os.environ.get('ITUNES_LOOKUP_DEADLINE', 15))
+
+# Where the search and lookup APIs live; point it at util/itunes_standin.py to work offline
+ITUNES_BASE_URL = os.environ.get('ITUNES_BASE_URL', 'https://itunes.apple.com').rstrip('/')
+
+
+@STRATEGY_SECONDS.time(strategy='combined')
+def combined_search(query):
+    """
+    Strategy 1: Direct search with artist and title combined.
+    Returns (track, good) where good means the best candidate scored above zero.
+    """
+    combined_term = f"{query.title} {query.artist}".replace(' ', '+')
+    url = f"{ITUNES_BASE_URL}/search?term={combined_term}&media=music&limit=25&entity=song"
+
+    response = itunes_get(url)
+    if response.status_code != 200:
+        raise ITunesError(f"iTunes API error: {response.status_code}")
+
+    results = response.json().get('results', [])
+    if not results:
+        logger.debug("No results found for combined search")
+        return None, False
+
+    logger.debug("Found %d results in combined search", len(results))
+    scored_results = score_candidates(query, results)
+    if logger.isEnabledFor(logging.DEBUG):
+        for score, result in scored_results:
+            logger.debug("  Candidate: %s by %s - Score: %s", result['trackName'], result['artistName'], score)
+
+    # Return the highest scored result
+    if scored_results and scored_results[0][0] > 0:
+        best_match = scored_results[0][1]
+        logger.debug("Best match: %s by %s (Score: %s)",
+                     best_match['trackName'], best_match['artistName'], scored_results[0][0])
+        return best_match, True
+    return None, False
+
+
+@STRATEGY_SECONDS.time(strategy='artist')
+def artist_search(query):
+    """
+    Strategy 2: Title search restricted to the artist.
+    Returns (track, good) where good means the track title matched exactly.
+    """
+    artist_query = query.artist.replace(' ', '+')
+    url = f"{ITUNES_BASE_URL}/search?term={query.title.replace(' ', '+')}&attribute=songTerm&media=music&entity=song&limit=10&artistTerm={artist_query}"
+
+    response = itunes_get(url)
+    if response.status_code != 200:
+        raise ITunesError(f"iTunes API error: {response.status_code}")
+
+    results = response.json().get('results', [])
+    if not results:
+        return None, False
+
+    logger.debug("Found %d results in artist-specific search", len(results))
+
+    # Filter for exact title matches first
+    exact_matches = [r for r in results if query.title_lower == r['trackName'].lower()]
+    if exact_matches:
+        logger.debug("Found exact title match: %s by %s", exact_matches[0]['trackName'], exact_matches[0]['artistName'])
+        return exact_matches[0], True
+
+    # Otherwise, fall back to the first result
+    return results[0], False
+
+
+@STRATEGY_SECONDS.time(strategy='album_lookup')
+def album_lookup(query, album):
+    """Look for the title among the tracks of one album."""
+    url = f"{ITUNES_BASE_URL}/lookup?id={album['collectionId']}&entity=song"
+
+    response = itunes_get(url)
+    if response.status_code != 200:
+        return None
+
+    songs = [r for r in response.json().get('results', []) if r.get('wrapperType') == 'track']
+
+    # Look for our title in the tracks
+    for song in songs:
+        if query.title_in(song['trackName']):
+            logger.debug("Found in album '%s': %s", album['collectionName'], song['trackName'])
+            return song
+    return None
+
+
+@STRATEGY_SECONDS.time(strategy='album')
+def album_search(query, deadline):
+    """
+    Strategy 3: Use collectionName to find the original album.
+    The artist's top studio albums are looked up concurrently and the first match wins.
+    """
+    logger.debug("Trying to find original album...")
+    url = f"{ITUNES_BASE_URL}/search?term={query.artist.replace(' ', '+')}&entity=album&limit=10&media=music"
+
+    response = itunes_get(url)
+    if response.status_code != 200:
+        raise ITunesError(f"iTunes API error: {response.status_code}")
+
+    albums = response.json().get('results', [])
+
+    # Filter for studio albums
+    albums = [a for a in albums if
+              a.get('collectionType') == 'Album' and 'live' not in a.get('collectionName', '').lower()]
+
+    # Try up to 3 top albums at once
+    lookups = [album_executor.submit(album_lookup, query, album) for album in albums[:3]]
+    try:
+        # Running out of time raises FuturesTimeout, so the caller doesn't take it for a miss
+        for future in as_completed(lookups, timeout=max(deadline - time.monotonic(), 0)):
+            try:
+                song = future.result()
+            except Exception as e:
+                logger.warning("Album lookup failed: %s", e)
+                continue
+            if song:
+                return song
+    finally:
+        for future in lookups:
+            future.cancel()
+    return None
+
+
+# Fetch
+@LOOKUP_SECONDS.time()
+def find_preview_track(title, artist):
+    """
+    Find the best matching iTunes track for a song with improved matching algorithm.
+    Strategies 1 and 2 run in parallel and the first good match wins; strategy 3
+    only runs if neither produced one. Pending work is cancelled once a match is found.
+    Returns the iTunes result dict (with 'previewUrl' and 'trackId'), or None if nothing matched.
+    Raises if every strategy failed with an error, or LookupTimeout if the deadline
+    passed first, so callers can tell a miss from a failure.
+    """
+    # Normalize artist name to handle featuring artists
+    primary_artist = primary_artist_name(artist)
+    logger.debug("Searching iTunes for: '%s' by '%s'", title, primary_artist)
+    query = SongQuery(title, primary_artist)
+
+    deadline = time.monotonic() + LOOKUP_DEADLINE
+    searches = {
+        strategy_executor.submit(combined_search, query): 'combined',
+        strategy_executor.submit(artist_search, query): 'artist'
+    }
+    fallbacks = {}
+    errors = []
+    timed_out = False
+    try:
+        for future in as_completed(searches, timeout=max(deadline - time.monotonic(), 0)):
+            strategy = searches[future]
+            try:
+                track, good = future.result()
+            except Exception as e:
+                logger.warning("iTunes %s search failed: %s", strategy, e)
+                STRATEGY_RESULTS.inc(strategy=strategy, result='error')
+                errors.append(e)
+                continue
+            STRATEGY_RESULTS.inc(strategy=strategy, result='good' if good else 'fallback' if track else 'miss')
+            if good:
+                LOOKUPS.inc(strategy=strategy)
+                return track
+            if track:
+                fallbacks[strategy] = track
+    except FuturesTimeout:
+        logger.warning("iTunes searches ran out of time")
+        timed_out = True
+    finally:
+        for future in searches:
+            future.cancel()
+
+    # Neither search found a good match, so settle for the artist search's first result
+    if 'artist' in fallbacks:
+        track = fallbacks['artist']
+        logger.debug("Using first result: %s by %s", track['trackName'], track['artistName'])
+        LOOKUPS.inc(strategy='artist_first_result')
+        return track
+
+    # Still nothing? Try a third approach, on the pool too so its HTTP retries can't outlast the deadline
+    if time.monotonic() >= deadline:
+        timed_out = True
+    else:
+        search = strategy_executor.submit(album_search, query, deadline)
+        try:
+            track = search.result(timeout=max(deadline - time.monotonic(), 0))
+        except FuturesTimeout:
+            logger.warning("iTunes album search ran out of time")
+            search.cancel()
+            timed_out = True
+        except Exception as e:
+            logger.warning("iTunes album search failed: %s", e)
+            STRATEGY_RESULTS.inc(strategy='album', result='error')
+            errors.append(e)
+        else:
+            STRATEGY_RESULTS.inc(strategy='album', result='good' if track else 'miss')
+            if track:
+                LOOKUPS.inc(strategy='album')
+                return track
+
+    if timed_out:
+        LOOKUPS.inc(strategy='timeout')
+        raise LookupTimeout(f"No answer within {LOOKUP_DEADLINE}s for '{title}'")
+    if len(errors) == 3:
+        LOOKUPS.inc(strategy='error')
+        raise errors[0]
+
+    logger.debug("All strategies failed to find a suitable match")
+    LOOKUPS.inc(strategy='none')
+    return None
+
+
+def search_preview_url(title, artist):
+    """
+    Fetch a song preview URL from iTunes API.
+    Returns None when no match is found or the lookup fails.
+    """
+    try:
+        track = find_preview_track(title, artist)
+    except Exception as e:
+        logger.warning("Error fetching preview: %s", e)
+        return None
+    return track.get('previewUrl') if track else None
+
+
+class PreviewCache:
+    """
+    Bounded LRU cache for preview URL lookups.
+    Found previews are kept for `ttl` seconds, while "no preview found" results
+    are kept for the shorter `negative_ttl` so misses get retried eventually
+    without hammering iTunes on every round.
+    """
+
+    def __init__(self, max_size=2048, ttl=6 * 60 * 60, negative_ttl=10 * 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Return (found, preview_url); found is False when the key is missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, preview_url = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, preview_url
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def peek(self, key):
+        """Like lookup(), but without counting a hit or miss or refreshing the entry's place in the LRU order."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def store(self, key, preview_url):
+        ttl = self.ttl if preview_url else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, preview_url)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+            negative = sum(1 for _, preview_url in self._entries.values() if not preview_url)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "negative_entries": negative,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+preview_cache = PreviewCache(
+    max_size=int(os.environ.get('PREVIEW_CACHE_SIZE', 2048)),
+    ttl=float(os.environ.get('PREVIEW_CACHE_TTL', 6 * 60 * 60)),
+    negative_ttl=float(os.environ.get('PREVIEW_CACHE_NEGATIVE_TTL', 10 * 60))
+)
+
+metrics.callback('yearworm_preview_cache_hits_total', "Preview cache hits.", 'counter', lambda: preview_cache.hits)
+metrics.callback('yearworm_preview_cache_misses_total', "Preview cache misses.", 'counter', lambda: preview_cache.misses)
+metrics.callback('yearworm_preview_cache_evictions_total', "Preview cache entries evicted to stay under max size.",
+                 'counter', lambda: preview_cache.evictions)
+metrics.callback('yearworm_preview_cache_entries', "Preview cache entries, found and not found.", 'gauge',
+                 lambda: len(preview_cache._entries))
+
+
+def get_preview_url(title, artist):
+    """
+    Cached front for find_preview_track(), keyed on normalized title and primary artist.
+    Failed lookups (errors and timeouts) return None without being cached, so
+    the song is asked for again rather than hidden as having no preview.
+    """
+    key = preview_cache_key(title, artist)
+    found, preview_url = preview_cache.lookup(key)
+    if found:
+        return preview_url
+
+    try:
+        track = find_preview_track(title, artist)
+    except Exception as e:
+        logger.warning("Error fetching preview: %s", e)
+        return None
+    preview_url = track.get('previewUrl') if track else None
+    preview_cache.store(key, preview_url)
+    return preview_url
@@ -0,0 +1,139 @@
+# journal.py
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; locking falls back to this process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledFile:
+    """
+    A snapshot file plus an append-only journal of changes made since it was written.
+    Writers append one JSON line to `<path>.journal` instead of rewriting the
+    snapshot, so a write costs O(1) whatever the size of the data. Loading
+    reads the snapshot and replays the journal on top of it. Once the journal
+    grows past `compact_bytes`, a background thread folds it into a new
+    snapshot (written to a temp file and renamed into place) and empties it.
+
+    All file access goes through an advisory lock on `<path>.lock`: shared
+    for reads, exclusive for appends and compaction, so several worker
+    processes can write without losing or corrupting entries.
+
+    `read_snapshot(path)` returns the data, `write_snapshot(path, data)`
+    writes it, and `replay(data, entries)` applies journal entries in place.
+    """
+
+    def __init__(self, path, read_snapshot, write_snapshot, replay, compact_bytes=256 * 1024):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.lock_path = f"{path}.lock"
+        self.read_snapshot = read_snapshot
+        self.write_snapshot = write_snapshot
+        self.replay = replay
+        self.compact_bytes = compact_bytes
+        self.compactions = 0
+        self._thread_lock = threading.Lock()
+        self._compacting = False
+
+    @contextmanager
+    def lock(self, shared=False):
+        """Hold the file lock (shared for readers, exclusive for writers)."""
+        if fcntl is None:
+            with self._thread_lock:
+                yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_entries(self):
+        entries = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn write from a crash; everything before it is intact
+                        logger.warning("Ignoring unreadable entry in %s", self.journal_path)
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _load_unlocked(self):
+        data = self.read_snapshot(self.path)
+        entries = self._read_entries()
+        if entries:
+            self.replay(data, entries)
+        return data
+
+    def load(self):
+        """Read the snapshot and replay the journal."""
+        with self.lock(shared=True):
+            return self._load_unlocked()
+
+    def append(self, entry):
+        """Durably record one change, then compact in the background if the journal has grown too big."""
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Durably record a batch of changes with a single write and fsync."""
+        data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+        with self.lock():
+            with open(self.journal_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+        if size >= self.compact_bytes:
+            self.compact_in_background()
+
+    def compact(self):
+        """Fold the journal into a new snapshot and empty it."""
+        with self.lock():
+            # Another process may have compacted already
+            if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+                return False
+            self.write_snapshot(self.path, self._load_unlocked())
+            os.truncate(self.journal_path, 0)
+        self.compactions += 1
+        return True
+
+    def compact_in_background(self):
+        """Start a compaction thread unless one is already running in this process."""
+        with self._thread_lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Failed to compact %s", self.journal_path)
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name='journal-compactor', daemon=True).start()
+
+    def replace(self, data):
+        """Write a whole new snapshot, dropping the journal (for tools that edit the full data)."""
+        with self.lock():
+            self.write_snapshot(self.path, data)
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, 0)
@@ -0,0 +1,116 @@
+# matching.py
+
+import re
+from functools import lru_cache
+
+# Patterns are compiled once at import instead of on every call
+PARENTHETICAL_RE = re.compile(r'\(.*?\)')
+VARIATION_RE = re.compile(r'remix|version|remaster|edit|radio|extended|feat\.|\bft\.|\bfeaturing\b')
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+FEATURED_RE = re.compile(r'ft\..*$|feat\..*$')
+
+# Words in a track name that suggest it isn't the original recording, with their penalty
+VERSION_PENALTIES = (
+    ('cover', 50),
+    ('tribute', 50),
+    ('karaoke', 100),
+    ('live', 30),
+    ('acoustic', 20),
+    ('instrumental', 40),
+    ('remix', 30),
+)
+
+
+@lru_cache(maxsize=65536)
+def normalize_title(title):
+    """Normalize a title by removing common variations and punctuation."""
+    title = title.lower()
+
+    # Remove anything in parentheses
+    title = PARENTHETICAL_RE.sub('', title)
+
+    # Remove common variations
+    title = VARIATION_RE.sub('', title)
+
+    # Remove punctuation and extra spaces
+    title = PUNCTUATION_RE.sub('', title)
+    return WHITESPACE_RE.sub(' ', title).strip()
+
+
+@lru_cache(maxsize=65536)
+def normalize_artist(artist):
+    """Normalize artist names."""
+    artist = artist.lower()
+
+    # Remove featured artists
+    artist = FEATURED_RE.sub('', artist)
+
+    # Collapse extra spaces
+    return WHITESPACE_RE.sub(' ', artist).strip()
+
+
+class SongQuery:
+    """The song being looked up, with every lowercase/word-set form computed once."""
+
+    __slots__ = ('title', 'artist', 'title_lower', 'artist_lower', 'title_words')
+
+    def __init__(self, title, artist):
+        self.title = title
+        self.artist = artist
+        self.title_lower = title.lower()
+        self.artist_lower = artist.lower()
+        self.title_words = set(self.title_lower.split())
+
+    def title_in(self, track_name):
+        """Whether the title appears in a track name (case-insensitive)."""
+        return self.title_lower in track_name.lower()
+
+
+def score_candidate(query, result):
+    """Score one iTunes result for a query, or return None if the artist doesn't match at all."""
+    artist_name = result['artistName'].lower()
+    track_name = result['trackName'].lower()
+
+    # Exact artist name match gets high score, partial match less
+    if query.artist_lower == artist_name:
+        score = 100
+    elif query.artist_lower in artist_name:
+        score = 50
+    else:
+        return None  # Skip completely different artists
+
+    # Exact, partial, or fuzzy (contains most words) title match
+    if query.title_lower == track_name:
+        score += 100
+    elif query.title_lower in track_name:
+        score += 50
+    elif len(query.title_words.intersection(track_name.split())) >= len(query.title_words) * 0.5:
+        score += 25
+
+    # Boost original recordings and avoid covers/live versions/remixes
+    for word, penalty in VERSION_PENALTIES:
+        if word in track_name:
+            score -= penalty
+
+    # Favor higher popularity
+    if 'trackPopularity' in result:
+        score += min(result['trackPopularity'] / 5, 20)
+
+    # Favor tracks from albums/EPs over singles
+    collection_name = result.get('collectionName')
+    if collection_name:
+        score += 30 if query.title_lower in collection_name.lower() else 10
+
+    return score
+
+
+def score_candidates(query, results):
+    """Score a batch of iTunes results in one pass; returns (score, result) pairs, best first."""
+    scored_results = []
+    for result in results:
+        score = score_candidate(query, result)
+        if score is not None:
+            scored_results.append((score, result))
+    scored_results.sort(reverse=True, key=lambda x: x[0])
+    return scored_results
@@ -0,0 +1,132 @@
+# sampler.py
+
+import random
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(value):
+    """SplitMix64 finalizer: a fast, well-distributed 64-bit integer hash."""
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class KeyedPermutation:
+    """
+    Seeded bijection over range(size), computed on demand.
+    A small Feistel network permutes the smallest even-bit domain covering
+    `size`, and cycle-walking folds it back into range(size). Looking up a
+    position costs O(1) expected time and no memory beyond the round keys.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max((size - 1).bit_length(), 2)
+        bits += bits % 2
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.round_keys = [mix64(seed ^ mix64(round_number)) for round_number in range(self.ROUNDS)]
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.round_keys:
+            left, right = right, left ^ (mix64(right ^ key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in reversed(self.round_keys):
+            left, right = right ^ (mix64(left ^ key) & self.half_mask), left
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, position):
+        """Value at a position of the permutation."""
+        value = self._encrypt(position)
+        # The domain is less than 4x size, so this takes under 4 steps on average
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def index(self, value):
+        """Position of a value in the permutation (the inverse of __getitem__)."""
+        position = self._decrypt(value)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+
+class ShuffledWalk:
+    """
+    Walks the song IDs ids[start:end] in a seeded pseudo-random order.
+    Its entire state is (seed, cursor), so a session can store it in two integers.
+    No song repeats until every song in the range has been played, then a new
+    shuffle starts.
+    """
+
+    def __init__(self, ids, start, end, seed=None, cursor=0):
+        self.ids = ids
+        self.start = start
+        self.size = end - start
+        if seed is None or cursor >= self.size:
+            seed, cursor = random.getrandbits(62), 0
+        self.seed = seed
+        self.cursor = cursor
+        self.permutation = KeyedPermutation(self.size, seed)
+
+    def next(self):
+        """Return the next song ID and advance."""
+        if self.cursor >= self.size:
+            # Every song has been played, reshuffle
+            self.seed, self.cursor = random.getrandbits(62), 0
+            self.permutation = KeyedPermutation(self.size, self.seed)
+        song_id = self.ids[self.start + self.permutation[self.cursor]]
+        self.cursor += 1
+        return song_id
+
+    def peek(self):
+        """Return the song ID next() would return, or None if the shuffle is about to restart."""
+        if self.cursor >= self.size:
+            return None
+        return self.ids[self.start + self.permutation[self.cursor]]
+
+
+class RandomAccessSet:
+    """
+    A set of integers supporting O(1) add, discard, membership and uniform
+    random sampling: members live in a list, with a dict of their positions
+    so a removed member can be swapped with the last one.
+    """
+
+    def __init__(self, values=()):
+        self.values = []
+        self.positions = {}
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.positions
+
+    def add(self, value):
+        if value not in self.positions:
+            self.positions[value] = len(self.values)
+            self.values.append(value)
+
+    def discard(self, value):
+        position = self.positions.pop(value, None)
+        if position is None:
+            return
+        last = self.values.pop()
+        if position < len(self.values):
+            self.values[position] = last
+            self.positions[last] = position
+
+    def sample(self, count, rng=random):
+        """Return up to `count` distinct members picked uniformly at random."""
+        return rng.sample(self.values, min(count, len(self.values)))
@@ -0,0 +1,159 @@
+# session_store.py
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class MemorySessionStore:
+    """Sessions kept in this process's memory. Only suitable for a single worker."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[sid]
+                return None
+            return data
+
+    def save(self, sid, data):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[sid] = (now + self.ttl, data)
+            # Sweep expired sessions at most once a minute
+            if now - self._purged_at > 60:
+                self._sessions = {key: entry for key, entry in self._sessions.items() if entry[0] > now}
+                self._purged_at = now
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """Sessions kept in a SQLite database, shared by every worker on the machine."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._purged_at = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "sid TEXT PRIMARY KEY, expires_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connect(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, sid, data):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, expires_at, data) VALUES (?, ?, ?)",
+                (sid, now + self.ttl, data)
+            )
+            if now - self._purged_at > 60:
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+                self._purged_at = now
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps session data in a server-side store; the cookie only carries a random session ID.
+    The data is stored as compact JSON and only written back when it changes.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSideSession(json.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(24), new=True)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        self.store.save(session.sid, json.dumps(dict(session), separators=(',', ':')))
+        response.set_cookie(
+            cookie_name,
+            session.sid,
+            max_age=int(self.store.ttl),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+def create_session_store(backend, ttl, db_path='sessions.db'):
+    """Build a store from a backend name ('memory' or 'sqlite'), or None to keep Flask's cookie sessions."""
+    if backend == 'memory':
+        return MemorySessionStore(ttl)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(db_path, ttl)
+    if backend == 'cookie':
+        return None
+    raise ValueError(f"Unknown session backend: {backend}")
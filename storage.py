@@ -0,0 +1,260 @@
+# storage.py
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from catalog import (CURATED_FILE, SONGS_FILE, SongTable, append_songs, artist_filter_key, check_year,
+                     curated_journal, file_signature, read_curated_songs, read_song_table, song_journal, song_key)
+from itunes import preview_cache_key
+
+RESOLVED_FILE = 'songs_resolved.json'
+
+
+class FileStorage:
+    """
+    The song catalog, curated schedule and resolved previews as data files.
+    Songs and curated dates added at runtime go to append-only journals next to
+    the files (see journal.JournaledFile).
+    """
+
+    def __init__(self, songs_path=SONGS_FILE, curated_path=CURATED_FILE, resolved_path=RESOLVED_FILE,
+                 read_songs=read_song_table, read_curated=read_curated_songs):
+        self.location = songs_path
+        self.resolved_path = resolved_path
+        self.songs_file = song_journal(songs_path, read_songs)
+        self.curated_file = curated_journal(curated_path, read_curated)
+
+    def load_songs(self):
+        return self.songs_file.load()
+
+    def load_curated(self):
+        return self.curated_file.load()
+
+    def load_resolved_entries(self):
+        """Return {preview_cache_key: enriched song} for every song resolved ahead of time."""
+        if not os.path.exists(self.resolved_path):
+            return {}
+        with open(self.resolved_path, 'r', encoding='utf-8') as f:
+            return {preview_cache_key(entry['title'], entry['artist']): entry for entry in json.load(f)}
+
+    def load_resolved_previews(self):
+        """Return {preview_cache_key: previewUrl or None}."""
+        return {key: entry.get('previewUrl') for key, entry in self.load_resolved_entries().items()}
+
+    def add_songs(self, songs, skip_duplicates=True):
+        """Add songs; with skip_duplicates, songs already in the catalog are dropped (when the journal is replayed)."""
+        songs = list(songs)
+        # A year the catalog can't hold would break every later load, so refuse the whole batch up front
+        for song in songs:
+            check_year(song['year'])
+        if skip_duplicates:
+            self.songs_file.extend([{"op": "add", "song": song} for song in songs])
+        else:
+            # Write straight into the snapshot, holding the lock so a compaction can't overwrite it
+            with self.songs_file.lock():
+                append_songs(self.songs_file.path, songs)
+
+    def set_curated(self, date, songs):
+        self.set_curated_dates({date: songs})
+
+    def set_curated_dates(self, curated_songs):
+        """Set the songs for several dates with a single journal write."""
+        self.curated_file.extend([{"op": "set", "date": date, "songs": songs} for date, songs in curated_songs.items()])
+
+    def replace_curated(self, curated_songs):
+        self.curated_file.replace(curated_songs)
+
+    def save_resolved_previews(self, songs, entries):
+        """Write the enriched catalog in catalog order, via a temp file so readers never see a partial file."""
+        enriched = []
+        written = set()
+        for song in songs:
+            key = preview_cache_key(song['title'], song['artist'])
+            if key in entries and key not in written:
+                enriched.append(entries[key])
+                written.add(key)
+
+        temp_path = f"{self.resolved_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(enriched, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.resolved_path)
+
+    def songs_signature(self):
+        return file_signature(self.songs_file.path, self.songs_file.journal_path)
+
+    def curated_signature(self):
+        return file_signature(self.curated_file.path, self.curated_file.journal_path)
+
+    def resolved_signature(self):
+        return file_signature(self.resolved_path)
+
+
+class SQLiteStorage:
+    """
+    The song catalog, curated schedule and resolved previews in one SQLite
+    database (WAL mode), shared safely by every worker on the machine.
+    Songs are indexed by year, normalized artist and title|artist key, and
+    curated songs by date. Each table has a version counter in `meta` that is
+    bumped in the same transaction as every write, so readers can cheaply tell
+    when to reload.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.location = path
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS songs ("
+                "id INTEGER PRIMARY KEY, title TEXT NOT NULL, artist TEXT NOT NULL, year INTEGER NOT NULL, "
+                "song_key TEXT NOT NULL, artist_key TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS songs_year ON songs (year)")
+            conn.execute("CREATE INDEX IF NOT EXISTS songs_artist_key ON songs (artist_key, year)")
+            conn.execute("CREATE INDEX IF NOT EXISTS songs_song_key ON songs (song_key)")
+            conn.execute("CREATE TABLE IF NOT EXISTS curated (date TEXT PRIMARY KEY, songs TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS previews ("
+                "title_key TEXT NOT NULL, artist_key TEXT NOT NULL, entry TEXT NOT NULL, "
+                "PRIMARY KEY (title_key, artist_key))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _connect(self):
+        # One connection per thread and per process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode; writes take the write lock up front in _transaction()
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _bump(conn, name):
+        conn.execute(
+            "INSERT INTO meta (name, version) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = version + 1",
+            (name,)
+        )
+
+    def _version(self, name):
+        row = self._connect().execute("SELECT version FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def load_songs(self):
+        table = SongTable()
+        for title, artist, year in self._connect().execute("SELECT title, artist, year FROM songs ORDER BY id"):
+            table.append(title, artist, year)
+        return table
+
+    def load_curated(self):
+        return {date: json.loads(songs) for date, songs in
+                self._connect().execute("SELECT date, songs FROM curated ORDER BY date")}
+
+    def load_resolved_entries(self):
+        return {(title_key, artist_key): json.loads(entry) for title_key, artist_key, entry in
+                self._connect().execute("SELECT title_key, artist_key, entry FROM previews")}
+
+    def load_resolved_previews(self):
+        return {key: entry.get('previewUrl') for key, entry in self.load_resolved_entries().items()}
+
+    @staticmethod
+    def _song_row(song):
+        return (song['title'], song['artist'], check_year(song['year']),
+                song_key(song['title'], song['artist']), artist_filter_key(song['artist']))
+
+    def add_songs(self, songs, skip_duplicates=True):
+        """Add songs in one transaction; with skip_duplicates, songs already in the catalog are dropped."""
+        rows = [self._song_row(song) for song in songs]
+        insert = "INSERT INTO songs (title, artist, year, song_key, artist_key) "
+        with self._transaction() as conn:
+            if skip_duplicates:
+                conn.executemany(
+                    insert + "SELECT ?1, ?2, ?3, ?4, ?5 WHERE NOT EXISTS (SELECT 1 FROM songs WHERE song_key = ?4)",
+                    rows
+                )
+            else:
+                conn.executemany(insert + "VALUES (?, ?, ?, ?, ?)", rows)
+            self._bump(conn, 'songs')
+
+    def set_curated(self, date, songs):
+        self.set_curated_dates({date: songs})
+
+    def set_curated_dates(self, curated_songs):
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO curated (date, songs) VALUES (?, ?)",
+                             [(date, json.dumps(songs, ensure_ascii=False)) for date, songs in curated_songs.items()])
+            self._bump(conn, 'curated')
+
+    def replace_curated(self, curated_songs):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM curated")
+            conn.executemany("INSERT INTO curated (date, songs) VALUES (?, ?)",
+                             [(date, json.dumps(songs, ensure_ascii=False)) for date, songs in curated_songs.items()])
+            self._bump(conn, 'curated')
+
+    def save_resolved_previews(self, songs, entries):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO previews (title_key, artist_key, entry) VALUES (?, ?, ?)",
+                [(title_key, artist_key, json.dumps(entry, ensure_ascii=False))
+                 for (title_key, artist_key), entry in entries.items()]
+            )
+            self._bump(conn, 'previews')
+
+    def import_data(self, songs, curated_songs, resolved_entries):
+        """Replace everything in the database in a single transaction (used for migrations)."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM songs")
+            conn.executemany("INSERT INTO songs (title, artist, year, song_key, artist_key) VALUES (?, ?, ?, ?, ?)",
+                             [self._song_row(song) for song in songs])
+            conn.execute("DELETE FROM curated")
+            conn.executemany("INSERT INTO curated (date, songs) VALUES (?, ?)",
+                             [(date, json.dumps(songs, ensure_ascii=False)) for date, songs in curated_songs.items()])
+            conn.execute("DELETE FROM previews")
+            conn.executemany("INSERT INTO previews (title_key, artist_key, entry) VALUES (?, ?, ?)",
+                             [(title_key, artist_key, json.dumps(entry, ensure_ascii=False))
+                              for (title_key, artist_key), entry in resolved_entries.items()])
+            for name in ('songs', 'curated', 'previews'):
+                self._bump(conn, name)
+
+    def songs_signature(self):
+        return self._version('songs')
+
+    def curated_signature(self):
+        return self._version('curated')
+
+    def resolved_signature(self):
+        return self._version('previews')
+
+
+def create_storage(backend, db_path='yearworm.db', **file_options):
+    """Build the storage for a backend name ('files' or 'sqlite'); file_options are passed to FileStorage."""
+    if backend == 'files':
+        return FileStorage(**file_options)
+    if backend == 'sqlite':
+        return SQLiteStorage(db_path)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def storage_from_env(**file_options):
+    """The storage selected by STORAGE_BACKEND and STORAGE_DB."""
+    return create_storage(os.environ.get('STORAGE_BACKEND', 'files'),
+                          db_path=os.environ.get('STORAGE_DB', 'yearworm.db'), **file_options)
@@ -1,25 +1,34 @@
-import json
+import argparse
+import csv
 import os
+import sys
+
+# Allow importing the app's modules when run as `python util/add_song.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import SongTable, check_song_batch, iter_songs
+from storage import storage_from_env
+
+storage = storage_from_env()
 
 
 def load_songs():
-    """Load the existing songs from songs.json"""
-    if os.path.exists('songs.json'):
-        try:
-            with open('songs.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            print("Error: songs.json is not a valid JSON file.")
-            return []
-    else:
-        print("Note: songs.json not found. A new file will be created.")
-        return []
-
-
-def save_songs(songs):
-    """Save the songs list back to songs.json"""
-    with open('songs.json', 'w', encoding='utf-8') as f:
-        json.dump(songs, f, indent=2)
+    """Load the existing songs, including songs added through the web app"""
+    try:
+        songs = storage.load_songs()
+    except ValueError:
+        # json.JSONDecodeError is a ValueError too
+        print(f"Error: {storage.location} is not a valid song catalog.")
+        return SongTable()
+    if not songs:
+        print(f"Note: no songs found in {storage.location}. It will be created.")
+    return songs
+
+
+def save_song(songs, song_id):
+    """Save a newly added song"""
+    # The user already confirmed adding it if it's a duplicate
+    storage.add_songs([songs[song_id]], skip_duplicates=False)
     print(f"Song collection saved. Total songs: {len(songs)}")
 
 
@@ -47,29 +56,57 @@ def add_song():
     songs = load_songs()
 
     # Check for duplicates
-    for song in songs:
-        if song['title'] == title and song['artist'] == artist:
-            print(f"Warning: This song appears to already exist in your collection.")
-            confirm_anyway = input("Add it anyway? (y/n): ").lower()
-            if confirm_anyway != 'y':
-                return
-            break
+    if songs.find(title, artist) is not None:
+        print(f"Warning: This song appears to already exist in your collection.")
+        confirm_anyway = input("Add it anyway? (y/n): ").lower()
+        if confirm_anyway != 'y':
+            return
 
     # Add the new song
-    new_song = {
-        "title": title,
-        "artist": artist,
-        "year": year
-    }
-
-    songs.append(new_song)
+    song_id = songs.append(title, artist, year)
 
     # Save the updated collection
-    save_songs(songs)
+    save_song(songs, song_id)
     print(f"Successfully added '{title}' by {artist} to your collection.")
 
 
+def read_batch_file(path):
+    """Read songs to import from a CSV file with title,artist,year columns, or a .json/.ndjson catalog"""
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            return list(csv.DictReader(f))
+    return list(iter_songs(path))
+
+
+def add_songs_from_file(path, dry_run=False):
+    """Validate every song in a batch file and save the new ones in a single write"""
+    rows = read_batch_file(path)
+    songs = load_songs()
+    new_songs, results = check_song_batch(songs, rows)
+
+    for result in results:
+        if result['status'] != 'added':
+            row = rows[result['row']]
+            print(f"Row {result['row'] + 1} ({row.get('title')!r} by {row.get('artist')!r}): "
+                  f"{result['status']} - {result['error']}")
+
+    if new_songs and not dry_run:
+        storage.add_songs(new_songs)
+
+    action = "Would add" if dry_run else "Added"
+    print(f"{action} {len(new_songs)} of {len(rows)} songs. Total songs: {len(songs) + (0 if dry_run else len(new_songs))}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Add songs to the collection, interactively or from a file.")
+    parser.add_argument('--batch', metavar='FILE', help="Import songs from a CSV (title,artist,year) or JSON/NDJSON file")
+    parser.add_argument('--dry-run', action='store_true', help="With --batch, only report what would be added")
+    args = parser.parse_args()
+
+    if args.batch:
+        add_songs_from_file(args.batch, dry_run=args.dry_run)
+        return
+
     while True:
         add_song()
         next_title = input("\nAdd another song? (y/n or enter next song title directly): ").strip()
@@ -100,26 +137,18 @@ def main():
 
             # Check for duplicates
             duplicate = False
-            for song in songs:
-                if song['title'] == next_title and song['artist'] == artist:
-                    print(f"Warning: This song appears to already exist in your collection.")
-                    confirm_anyway = input("Add it anyway? (y/n): ").lower()
-                    if confirm_anyway != 'y':
-                        duplicate = True
-                    break
+            if songs.find(next_title, artist) is not None:
+                print(f"Warning: This song appears to already exist in your collection.")
+                confirm_anyway = input("Add it anyway? (y/n): ").lower()
+                if confirm_anyway != 'y':
+                    duplicate = True
 
             if not duplicate:
                 # Add the new song
-                new_song = {
-                    "title": next_title,
-                    "artist": artist,
-                    "year": year
-                }
-
-                songs.append(new_song)
+                song_id = songs.append(next_title, artist, year)
 
                 # Save the updated collection
-                save_songs(songs)
+                save_song(songs, song_id)
                 print(f"Successfully added '{next_title}' by {artist} to your collection.")
         # If they just entered 'y' or 'yes', the loop will continue to add_song()
         elif next_title.lower() not in ['y', 'yes']:
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlparse
+
+# Allow importing the app's modules when run as `python util/bench_endpoints.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itunes
+from app import create_app, curated_catalog, resolved_catalog, song_catalog
+from itunes_standin import synthesize_results
+
+FREE_ROUNDS = 10
+FREE_RETRY_WAIT = 0.005  # The stub answers in microseconds, so poll rather than honor Retry-After
+METRICS = ('p50', 'p95', 'p99')
+CATALOGS = (song_catalog, curated_catalog, resolved_catalog)
+
+
+class StubResponse:
+    """Just enough of requests.Response for the iTunes strategies."""
+
+    def __init__(self, payload):
+        self.status_code = 200
+        self.headers = {}
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+def make_itunes_stub(latency):
+    """A local stand-in for itunes_get that answers song searches with a matching track after `latency` seconds."""
+    def stub_itunes_get(url):
+        if latency:
+            time.sleep(latency)
+        return StubResponse(synthesize_results(dict(parse_qsl(urlparse(url).query))))
+    return stub_itunes_get
+
+
+def catalog_loads():
+    """Times the app's catalogs (songs, curated dates, resolved previews) have been read from storage so far."""
+    return sum(catalog.load_count for catalog in CATALOGS)
+
+
+class Recorder:
+    """Per-endpoint latency samples, allocation peaks and catalog reload counts."""
+
+    def __init__(self, app, trace_allocations=False):
+        self.app = app
+        self.trace_allocations = trace_allocations
+        self.latencies = defaultdict(list)
+        self.allocations = defaultdict(list)
+        self.catalog_loads = defaultdict(int)
+        self.enabled = True
+
+    def call(self, name, request, retry_status=None):
+        """
+        Run one request, recording it under `name` unless recording is paused for warm-up.
+        A `retry_status` answer is recorded under `<name> retry` instead of failing.
+        """
+        loads_before = catalog_loads()
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        response = request()
+        elapsed = time.perf_counter() - start
+        if self.trace_allocations:
+            peak = tracemalloc.get_traced_memory()[1]
+        loads = catalog_loads() - loads_before
+        if response.status_code == retry_status:
+            name = f"{name} retry"
+
+        if self.enabled:
+            if self.trace_allocations:
+                self.allocations[name].append(max(peak - before, 0))
+            else:
+                self.latencies[name].append(elapsed)
+            self.catalog_loads[name] += loads
+        if response.status_code >= 400 and response.status_code != retry_status:
+            raise RuntimeError(f"{name} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response
+
+
+def play_daily(recorder):
+    client = recorder.app.test_client()
+    recorder.call('daily /daily', lambda: client.get('/daily'))
+    while True:
+        song = recorder.call('daily /get-song', lambda: client.get('/get-song')).get_json()
+        if song.get('gameOver'):
+            return
+        result = recorder.call('daily /check-guess', lambda: client.post('/check-guess', json={"guess": song['year'] + 3}))
+        if result.get_json().get('game_over'):
+            return
+
+
+def play_free(recorder, rounds=FREE_ROUNDS):
+    client = recorder.app.test_client()
+    recorder.call('free /free', lambda: client.get('/free?unlimited=true'))
+    for _ in range(rounds):
+        # 503 means no song's preview has resolved yet
+        response = recorder.call('free /get-song', lambda: client.get('/get-song'), retry_status=503)
+        while response.status_code == 503:
+            time.sleep(FREE_RETRY_WAIT)
+            response = recorder.call('free /get-song', lambda: client.get('/get-song'), retry_status=503)
+        song = response.get_json()
+        recorder.call('free /check-guess', lambda: client.post('/check-guess', json={"guess": song['year']}))
+
+
+def run(app, games, warmup, trace_allocations=False):
+    recorder = Recorder(app, trace_allocations)
+    recorder.enabled = False
+    for _ in range(warmup):
+        play_daily(recorder)
+        play_free(recorder)
+    recorder.enabled = True
+    for _ in range(games):
+        play_daily(recorder)
+        play_free(recorder)
+    return recorder
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(timing, allocations):
+    """Combine the timing and allocation passes into {endpoint: metrics}."""
+    results = {}
+    for name, samples in sorted(timing.latencies.items()):
+        samples = sorted(samples)
+        requests = len(samples)
+        alloc_samples = allocations.allocations.get(name, [])
+        results[name] = {
+            "requests": requests,
+            "p50": percentile(samples, 0.50) * 1000,
+            "p95": percentile(samples, 0.95) * 1000,
+            "p99": percentile(samples, 0.99) * 1000,
+            "alloc_kib": sum(alloc_samples) / len(alloc_samples) / 1024 if alloc_samples else 0.0,
+            "catalog_loads": timing.catalog_loads[name] / requests
+        }
+    return results
+
+
+def print_results(results):
+    print(f"{'endpoint':<22}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'alloc KiB':>11}{'catalog loads':>15}")
+    for name, metrics in results.items():
+        print(f"{name:<22}{metrics['requests']:>9}{metrics['p50']:>9.2f}{metrics['p95']:>9.2f}{metrics['p99']:>9.2f}"
+              f"{metrics['alloc_kib']:>11.1f}{metrics['catalog_loads']:>15.2f}")
+
+
+def find_regressions(results, baseline, threshold):
+    """Latency percentiles more than `threshold` (a fraction) above the baseline, or any new catalog reloads."""
+    regressions = []
+    for name, metrics in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in METRICS:
+            # With few samples p99 is just the slowest request, which is mostly noise
+            if metric == 'p99' and metrics['requests'] < 100:
+                continue
+            # Ignore sub-millisecond noise
+            if metrics[metric] > before[metric] * (1 + threshold) and metrics[metric] - before[metric] > 0.5:
+                regressions.append(f"{name} {metric}: {before[metric]:.2f} ms -> {metrics[metric]:.2f} ms")
+        # A request that re-reads a catalog parses the whole file (or table) again, whichever format it's in
+        if metrics['catalog_loads'] > before.get('catalog_loads', 0):
+            regressions.append(f"{name} catalog loads per request: {before.get('catalog_loads', 0):.2f} -> "
+                               f"{metrics['catalog_loads']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark a daily and a free-play game through Flask's test client, with iTunes stubbed locally.")
+    parser.add_argument('--games', type=int, default=50, help="Games of each mode to measure (default: 50)")
+    parser.add_argument('--warmup', type=int, default=3, help="Games of each mode to play first, unmeasured (default: 3)")
+    parser.add_argument('--itunes-latency', type=float, default=0.0,
+                        help="Seconds the iTunes stub waits before answering (default: 0)")
+    parser.add_argument('--baseline', default='bench_baseline.json',
+                        help="Baseline to compare against (default: bench_baseline.json)")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Allowed slowdown before a percentile counts as a regression (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    app = create_app()
+    itunes.itunes_get = make_itunes_stub(args.itunes_latency)
+    random.seed(0)
+
+    timing = run(app, args.games, args.warmup)
+    tracemalloc.start()
+    try:
+        allocations = run(app, max(args.games // 5, 1), 1, trace_allocations=True)
+    finally:
+        tracemalloc.stop()
+
+    results = summarize(timing, allocations)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nRegressions against {args.baseline} (threshold {args.threshold:.0%}):")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Allow importing the app's modules when run as `python util/bench_matching.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import iter_songs
+import matching
+
+SUFFIXES = ['', ' (Remastered)', ' - Live', ' (Acoustic)', ' [Karaoke Version]', ' (Remix)', ' - Cover']
+
+
+def make_candidates(songs, rng, count):
+    """Fake iTunes search results built from catalog songs, with typical version suffixes."""
+    candidates = []
+    for _ in range(count):
+        song = rng.choice(songs)
+        result = {
+            "trackName": song['title'] + rng.choice(SUFFIXES),
+            "artistName": song['artist'],
+            "collectionName": rng.choice([song['title'], "Greatest Hits", ""])
+        }
+        if rng.random() < 0.5:
+            result["trackPopularity"] = rng.randint(0, 100)
+        candidates.append(result)
+    return candidates
+
+
+def time_per_item(func, items, repeat):
+    """Best-of-`repeat` time per item in nanoseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(items) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the shared song-matching engine.")
+    parser.add_argument('--songs', default='songs.json',
+                        help="Catalog to draw titles from, .json or .ndjson (default: songs.json)")
+    parser.add_argument('--queries', type=int, default=200, help="Number of lookups to simulate (default: 200)")
+    parser.add_argument('--candidates', type=int, default=25, help="iTunes results per lookup (default: 25)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement, best is reported (default: 5)")
+    args = parser.parse_args()
+
+    songs = list(iter_songs(args.songs))
+    rng = random.Random(0)
+
+    lookups = []
+    for _ in range(args.queries):
+        song = rng.choice(songs)
+        candidates = make_candidates(songs, rng, args.candidates - 5)
+        # Make sure the batch includes some same-artist candidates, as a real search would
+        candidates += [dict(c, artistName=song['artist']) for c in make_candidates(songs, rng, 5)]
+        lookups.append((matching.SongQuery(song['title'], song['artist']), candidates))
+
+    def score_all(items):
+        for query, candidates in items:
+            matching.score_candidates(query, candidates)
+
+    per_lookup = time_per_item(score_all, lookups, args.repeat)
+    print(f"score_candidates: {per_lookup / args.candidates:,.0f} ns per candidate "
+          f"({per_lookup / 1000:,.1f} us per {args.candidates}-result lookup)")
+
+    titles = [song['title'] for song in songs]
+    artists = [song['artist'] for song in songs]
+
+    def normalize_all(items):
+        for title, artist in items:
+            matching.normalize_title(title)
+            matching.normalize_artist(artist)
+
+    pairs = list(zip(titles, artists))
+    matching.normalize_title.cache_clear()
+    matching.normalize_artist.cache_clear()
+    cold = time_per_item(normalize_all, pairs, 1)
+    warm = time_per_item(normalize_all, pairs, args.repeat)
+    print(f"normalize title+artist: {cold:,.0f} ns per song cold, {warm:,.0f} ns per song cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import sys
+
+# Allow importing the app's modules when run as `python util/convert_catalog.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import is_ndjson, iter_songs
+
+
+def convert(source, destination):
+    """Stream every song from one catalog file into another; returns the number of songs written."""
+    temp_path = f"{destination}.tmp"
+    count = 0
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if is_ndjson(destination):
+            for song in iter_songs(source):
+                f.write(json.dumps(song, ensure_ascii=False) + '\n')
+                count += 1
+        else:
+            # Legacy array, written element by element in json.dump(indent=2) layout
+            f.write('[')
+            for song in iter_songs(source):
+                body = json.dumps(song, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+                f.write((',\n  ' if count else '\n  ') + body)
+                count += 1
+            f.write('\n]' if count else ']')
+    os.replace(temp_path, destination)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a song catalog between the JSON array (.json) and line-delimited (.ndjson) formats.")
+    parser.add_argument('source', help="Catalog to read, e.g. songs.json")
+    parser.add_argument('destination', help="Catalog to write, e.g. songs.ndjson; the format follows the extension")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.source) == os.path.abspath(args.destination):
+        parser.error("source and destination must be different files")
+
+    count = convert(args.source, args.destination)
+    print(f"Wrote {count} songs to {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,86 @@
-import json
+import argparse
 import random
+import sys
+from collections import defaultdict
 from datetime import datetime, timedelta
 import os
 
+# Allow importing the app's modules when run as `python util/curation.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CURATED_FILE, SONGS_FILE, SongTable, artist_filter_key
+from daily import DAILY_ROUNDS
+from sampler import RandomAccessSet
+from storage import FileStorage, storage_from_env
+
+# Most search results shown at once
+SEARCH_LIMIT = 50
+
 
 class SongCurator:
-    def __init__(self, songs_file="songs.json", curated_file="curated_songs.json"):
-        self.songs_file = songs_file
-        self.curated_file = curated_file
-        self.all_songs = []
+    def __init__(self, songs_file=SONGS_FILE, curated_file=CURATED_FILE, storage=None):
+        # Without a storage, read and write the given data files
+        self.storage = storage or FileStorage(songs_file, curated_file)
+        self.all_songs = SongTable()
         self.curated_songs = {}
+        self.used_song_ids = set()
+        self.unused_song_ids = RandomAccessSet()
         self.load_files()
 
     def load_files(self):
-        """Load the songs and curated_songs JSON files"""
+        """Load the songs and curated songs from storage"""
         try:
-            with open(self.songs_file, 'r', encoding='utf-8') as f:
-                self.all_songs = json.load(f)
-            print(f"Loaded {len(self.all_songs)} songs from {self.songs_file}")
+            # This picks up songs and dates added through the web app too
+            self.all_songs = self.storage.load_songs()
+            print(f"Loaded {len(self.all_songs)} songs from {self.storage.location}")
 
-            try:
-                with open(self.curated_file, 'r', encoding='utf-8') as f:
-                    self.curated_songs = json.load(f)
+            self.curated_songs = self.storage.load_curated()
+            if self.curated_songs:
                 print(f"Loaded curated songs for {len(self.curated_songs)} dates")
-            except FileNotFoundError:
-                print(f"No existing {self.curated_file} found. Will create a new one.")
-                self.curated_songs = {}
+            else:
+                print("No curated songs found yet. They will be created.")
         except Exception as e:
             print(f"Error loading files: {e}")
             exit(1)
 
-    def save_curated_songs(self):
-        """Save the curated songs back to the JSON file"""
-        with open(self.curated_file, 'w', encoding='utf-8') as f:
-            json.dump(self.curated_songs, f, indent=2)
-        print(f"Saved curated songs to {self.curated_file}")
+        # The search index is only built by the first search, so the batch planner never pays for it
+        self.refresh_used_songs()
+
+    def save_curated_songs(self, date_str=None):
+        """Save one date's curated songs, or replace all of them if no date is given"""
+        if date_str is None:
+            self.storage.replace_curated(self.curated_songs)
+        else:
+            self.storage.set_curated(date_str, self.curated_songs[date_str])
+        print("Saved curated songs")
 
-    def get_used_song_ids(self):
-        """Get a set of all song IDs that have already been used in curated_songs"""
+    def get_used_song_ids(self, curated_songs=None):
+        """Get a set of all catalog song IDs that have already been used in curated_songs (or the given dates)"""
+        if curated_songs is None:
+            curated_songs = self.curated_songs
         used_songs = set()
-        for date, songs in self.curated_songs.items():
+        for date, songs in curated_songs.items():
             for song in songs:
-                # Create a unique identifier for each song
-                song_id = f"{song['title']}|{song['artist']}"
-                used_songs.add(song_id)
+                song_id = self.all_songs.find(song['title'], song['artist'])
+                if song_id is not None:
+                    used_songs.add(song_id)
         return used_songs
 
-    def search_songs(self, query):
-        """Search for songs by title or artist"""
-        query = query.lower()
-        results = []
+    def refresh_used_songs(self):
+        """Recompute the used and unused song IDs from the curated songs"""
+        self.used_song_ids = self.get_used_song_ids()
+        self.unused_song_ids = RandomAccessSet(song_id for song_id in range(len(self.all_songs))
+                                               if song_id not in self.used_song_ids)
 
-        for i, song in enumerate(self.all_songs):
-            if query in song['title'].lower() or query in song['artist'].lower():
-                results.append((i, song))
+    def mark_used(self, song_id):
+        """Record that a song has been picked for a date"""
+        self.used_song_ids.add(song_id)
+        self.unused_song_ids.discard(song_id)
 
-        return results
+    def search_songs(self, query, limit=SEARCH_LIMIT):
+        """Search for songs by title or artist, best matches first"""
+        return [(song_id, self.all_songs[song_id])
+                for song_id in self.all_songs.search_index().search(query, limit)]
 
     def display_search_results(self, results):
         """Display search results with numbers for selection"""
@@ -81,13 +106,12 @@ class SongCurator:
                 return
             elif action == 'r':
                 self.curated_songs[date_str] = []
+                # The replaced songs may be free to use again
+                self.refresh_used_songs()
             # For 'a', we'll just continue and add more
         else:
             self.curated_songs[date_str] = []
 
-        # Get songs that have already been used
-        used_songs = self.get_used_song_ids()
-
         # How many more songs we need to add
         needed = 5 - len(self.curated_songs[date_str])
 
@@ -101,15 +125,11 @@ class SongCurator:
                 break
             elif choice.lower() == 'r':
                 # Show random suggestions, avoiding already used songs
-                unused_songs = [(i, song) for i, song in enumerate(self.all_songs)
-                                if f"{song['title']}|{song['artist']}" not in used_songs]
-
-                if not unused_songs:
+                if not self.unused_song_ids:
                     print("No unused songs left!")
                     continue
 
-                sample_size = min(10, len(unused_songs))
-                suggestions = random.sample(unused_songs, sample_size)
+                suggestions = [(song_id, self.all_songs[song_id]) for song_id in self.unused_song_ids.sample(10)]
                 self.display_search_results(suggestions)
 
                 selection = input("Enter the number to select, 'n' for new suggestions, or press Enter to skip: ")
@@ -117,9 +137,9 @@ class SongCurator:
                     continue
                 elif selection.isdigit() and 1 <= int(selection) <= len(suggestions):
                     song_idx = int(selection) - 1
-                    selected_song = suggestions[song_idx][1]
+                    song_id, selected_song = suggestions[song_idx]
                     self.curated_songs[date_str].append(selected_song)
-                    used_songs.add(f"{selected_song['title']}|{selected_song['artist']}")
+                    self.mark_used(song_id)
                     selections.append(selected_song)
                     print(f"Added: {selected_song['title']} by {selected_song['artist']}")
             else:
@@ -133,23 +153,22 @@ class SongCurator:
                 selection = input("Enter the number to select or press Enter to skip: ")
                 if selection.isdigit() and 1 <= int(selection) <= len(results):
                     song_idx = int(selection) - 1
-                    selected_song = results[song_idx][1]
-                    song_id = f"{selected_song['title']}|{selected_song['artist']}"
+                    song_id, selected_song = results[song_idx]
 
-                    if song_id in used_songs:
+                    if song_id in self.used_song_ids:
                         print("This song has already been used in your curated list.")
                         use_anyway = input("Use it anyway? (y/n): ").lower() == 'y'
                         if not use_anyway:
                             continue
 
                     self.curated_songs[date_str].append(selected_song)
-                    used_songs.add(song_id)
+                    self.mark_used(song_id)
                     selections.append(selected_song)
                     print(f"Added: {selected_song['title']} by {selected_song['artist']}")
 
         # Save after adding songs for this date
         if selections:
-            self.save_curated_songs()
+            self.save_curated_songs(date_str)
             print(f"Added {len(selections)} songs for {date_str}")
 
     def find_next_unaccounted_date(self):
@@ -171,6 +190,98 @@ class SongCurator:
         # Return the next date, including future dates
         return next_date.strftime("%Y-%m-%d")
 
+    def plan_schedule(self, days, start_date=None, theme='mixed', rng=random, overwrite=False):
+        """
+        Pick songs for `days` consecutive dates in one pass, without reusing songs.
+        Dates that are already curated are skipped, unless `overwrite` is set:
+        then they're planned again and their old songs become available.
+        Every day has at most one song per artist. A 'mixed' day spreads its
+        songs over different decades; a 'decade' day takes them all from one
+        decade (the theme suggest_theme looks for), rotating between decades.
+        Unused songs are bucketed by decade once and shuffled, so each pick is
+        a pop from a bucket. Returns {date: songs}; nothing is saved.
+        """
+        if start_date is None:
+            start_date = self.find_next_unaccounted_date()
+        date = datetime.strptime(start_date, "%Y-%m-%d")
+        dates = [(date + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(days)]
+
+        unused_song_ids = self.unused_song_ids.values
+        curated_dates = [date_str for date_str in dates if date_str in self.curated_songs]
+        if curated_dates and not overwrite:
+            print(f"Skipping {len(curated_dates)} already curated dates (use --overwrite to replace them)")
+            dates = [date_str for date_str in dates if date_str not in self.curated_songs]
+        elif curated_dates:
+            # Songs only used on the dates being replaced can be picked again
+            kept = {date_str: songs for date_str, songs in self.curated_songs.items() if date_str not in curated_dates}
+            still_used = self.get_used_song_ids(kept)
+            unused_song_ids = [song_id for song_id in range(len(self.all_songs)) if song_id not in still_used]
+
+        # Precompute decade buckets of unused songs and each artist's normalized key
+        buckets = defaultdict(list)
+        for song_id in unused_song_ids:
+            buckets[self.all_songs.year(song_id) // 10 * 10].append(song_id)
+        for bucket in buckets.values():
+            rng.shuffle(bucket)
+        artist_keys = [artist_filter_key(artist) for artist in self.all_songs.artists]
+
+        def pop_song(decade, artists_today):
+            # Skip songs by artists already playing today, and put them back for later days
+            bucket = buckets[decade]
+            skipped = []
+            song_id = None
+            while bucket:
+                candidate = bucket.pop()
+                if artist_keys[self.all_songs.artist_id(candidate)] in artists_today:
+                    skipped.append(candidate)
+                else:
+                    song_id = candidate
+                    break
+            bucket.extend(reversed(skipped))
+            return song_id
+
+        plan = {}
+        for date_str in dates:
+            available = [decade for decade, bucket in buckets.items() if bucket]
+            if theme == 'decade':
+                # The decade with the most songs left, so the rotation evens out; others only if it runs dry
+                decades = sorted(available, key=lambda decade: len(buckets[decade]), reverse=True)
+                decades = decades[:1] * DAILY_ROUNDS + decades
+            else:
+                # Distinct decades, favoring those with more songs left (weighted sampling without replacement)
+                decades = sorted(available, key=lambda decade: rng.random() ** (1 / len(buckets[decade])), reverse=True)
+                decades = decades[:DAILY_ROUNDS]
+                decades += sorted(available, key=lambda decade: len(buckets[decade]), reverse=True) * DAILY_ROUNDS
+
+            songs = []
+            artists_today = set()
+            for decade in decades:
+                if len(songs) == DAILY_ROUNDS:
+                    break
+                song_id = pop_song(decade, artists_today)
+                if song_id is None:
+                    continue
+                artists_today.add(artist_keys[self.all_songs.artist_id(song_id)])
+                songs.append(song_id)
+
+            if len(songs) < DAILY_ROUNDS:
+                print(f"Ran out of unused songs at {date_str}; planned {len(plan)} days")
+                break
+            plan[date_str] = songs
+
+        return {date_str: [self.all_songs[song_id] for song_id in song_ids] for date_str, song_ids in plan.items()}
+
+    def apply_plan(self, plan, overwrite=False):
+        """Save a planned schedule in one write and mark its songs as used"""
+        curated_dates = sorted(date_str for date_str in plan if date_str in self.curated_songs)
+        if curated_dates and not overwrite:
+            raise ValueError(f"Already curated: {', '.join(curated_dates)}")
+        self.storage.set_curated_dates(plan)
+        self.curated_songs.update(plan)
+        # Recount rather than marking the new songs, so songs of replaced dates are freed up
+        self.refresh_used_songs()
+        print(f"Saved curated songs for {len(plan)} dates")
+
     def show_curated_songs(self):
         """Display all curated songs by date"""
         if not self.curated_songs:
@@ -230,7 +341,28 @@ class SongCurator:
 
 
 def main():
-    curator = SongCurator()
+    parser = argparse.ArgumentParser(description="Curate the daily songs, interactively or with the batch planner.")
+    parser.add_argument('--plan', type=int, metavar='DAYS', help="Plan this many dates after the last curated one and exit")
+    parser.add_argument('--start', help="First date to plan, YYYY-MM-DD (default: the next unaccounted date)")
+    parser.add_argument('--theme', choices=['mixed', 'decade'], default='mixed',
+                        help="'mixed' spreads each day over decades, 'decade' gives each day one decade (default: mixed)")
+    parser.add_argument('--seed', type=int, help="Random seed, for a reproducible plan")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="Replace dates that are already curated instead of skipping them")
+    parser.add_argument('--dry-run', action='store_true', help="Show the plan without saving it")
+    args = parser.parse_args()
+
+    curator = SongCurator(storage=storage_from_env())
+
+    if args.plan:
+        plan = curator.plan_schedule(args.plan, args.start, args.theme, random.Random(args.seed), args.overwrite)
+        for date_str, songs in plan.items():
+            print(f"\n{date_str}:")
+            for i, song in enumerate(songs):
+                print(f"  {i + 1}. {song['title']} by {song['artist']} ({song['year']})")
+        if plan and not args.dry_run:
+            curator.apply_plan(plan, args.overwrite)
+        return
 
     while True:
         print("\n--- Song Curator Menu ---")
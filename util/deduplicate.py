@@ -1,39 +1,18 @@
-import json
+import argparse
 import difflib
-import re
-from collections import defaultdict
+import os
+import sys
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
+# Allow importing the app's modules when run as `python util/deduplicate.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def normalize_title(title):
-    """Normalize a title by removing common variations and punctuation."""
-    # Convert to lowercase
-    title = title.lower()
-
-    # Remove anything in parentheses
-    title = re.sub(r'\(.*?\)', '', title)
-
-    # Remove common variations
-    title = re.sub(r'remix|version|remaster|edit|radio|extended|feat\.|\bft\.|\bfeaturing\b', '', title)
-
-    # Remove punctuation and extra spaces
-    title = re.sub(r'[^\w\s]', '', title)
-    title = re.sub(r'\s+', ' ', title).strip()
-
-    return title
-
-
-def normalize_artist(artist):
-    """Normalize artist names."""
-    # Convert to lowercase
-    artist = artist.lower()
-
-    # Remove featured artists
-    artist = re.sub(r'ft\..*$|feat\..*$', '', artist)
-
-    # Remove punctuation and extra spaces
-    artist = re.sub(r'\s+', ' ', artist).strip()
-
-    return artist
+from catalog import iter_songs, primary_artist_name, write_songs
+from matching import normalize_artist, normalize_title
+from storage import storage_from_env
 
 
 def remove_exact_duplicates(songs_list):
@@ -51,38 +30,181 @@ def remove_exact_duplicates(songs_list):
     return list(unique_songs.values())
 
 
-def find_near_duplicates(songs_list):
-    """Find songs that are likely duplicates but with slight variations."""
-    # Group songs by normalized title
-    title_groups = defaultdict(list)
-
-    for song in songs_list:
-        norm_title = normalize_title(song['title'])
-        if len(norm_title) > 3:  # Skip very short titles
-            title_groups[norm_title].append(song)
-
-    # Find groups with multiple songs
-    potential_duplicates = []
-
-    for norm_title, songs in title_groups.items():
-        if len(songs) > 1:
-            # Check if artists are similar
-            for i, song1 in enumerate(songs):
-                norm_artist1 = normalize_artist(song1['artist'])
-
-                for song2 in songs[i + 1:]:
-                    norm_artist2 = normalize_artist(song2['artist'])
-
-                    # Check if artists are similar
-                    similarity = difflib.SequenceMatcher(None, norm_artist1, norm_artist2).ratio()
-
-                    if similarity > 0.6 or norm_artist1 in norm_artist2 or norm_artist2 in norm_artist1:
-                        potential_duplicates.append((song1, song2))
-
-    return potential_duplicates
-
-
-def recommend_songs_to_keep(songs_list):
+# MinHash/LSH blocking parameters: 8 bands of 4 rows pair up songs whose
+# title+artist shingle sets have a Jaccard similarity of roughly 0.6 or more
+LSH_BANDS = 8
+LSH_ROWS = 4
+SIGNATURE_BITS = 5  # 2 ** 5 == LSH_BANDS * LSH_ROWS bins
+MASK64 = (1 << 64) - 1
+BIN_VALUE_MASK = (1 << (64 - SIGNATURE_BITS)) - 1
+
+# Buckets bigger than this are skipped rather than compared pairwise
+MAX_BUCKET_SIZE = 200
+
+# Minimum similarity for two normalized titles to count as the same song
+TITLE_SIMILARITY = 0.85
+
+# Titles that only differ by one of these are different songs ("Part One" / "Part Two")
+NUMBER_WORDS = {'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+                'i', 'ii', 'iii', 'iv', 'v', 'vi', 'first', 'second', 'third', 'pt', 'part'}
+
+
+def shingle_hashes(norm_title, norm_artist):
+    """Stable hashes of the 3-grams of a song's title and artist (tagged so the two don't mix)."""
+    shingles = set()
+    for tag, text in ((1, norm_title), (2, norm_artist)):
+        data = f" {text} ".encode('utf-8')
+        for i in range(max(len(data) - 2, 1)):
+            shingles.add(zlib.crc32(data[i:i + 3], tag))
+    return shingles
+
+
+def minhash_signature(hashes):
+    """
+    One-permutation MinHash with rotation densification.
+    Each shingle hash lands in one of 32 bins and every bin keeps its minimum;
+    empty bins borrow from the next non-empty bin. This costs O(shingles + bins)
+    instead of O(shingles * bins) for classic MinHash.
+    """
+    bin_count = 1 << SIGNATURE_BITS
+    bins = [None] * bin_count
+    for value in hashes:
+        value = (value * 0x9E3779B97F4A7C15) & MASK64
+        slot, value = value >> (64 - SIGNATURE_BITS), value & BIN_VALUE_MASK
+        if bins[slot] is None or value < bins[slot]:
+            bins[slot] = value
+
+    signature = list(bins)
+    for slot in range(bin_count):
+        if signature[slot] is None:
+            distance = 1
+            while bins[(slot + distance) % bin_count] is None:
+                distance += 1
+            signature[slot] = bins[(slot + distance) % bin_count] + (distance << (64 - SIGNATURE_BITS))
+    return signature
+
+
+def lsh_keys(norm_title, norm_artist):
+    """Blocking keys for a song: one per MinHash band, plus its exact title with the artist's first letters."""
+    signature = minhash_signature(shingle_hashes(norm_title, norm_artist))
+    keys = [(band, *signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]) for band in range(LSH_BANDS)]
+    # Same title and similar artist credits ("Queen" vs "Queen & David Bowie") always meet
+    keys.append(('title', norm_title, norm_artist[:3]))
+    return keys
+
+
+def is_similar_artist(norm_artist1, norm_artist2):
+    """Check if two normalized artist names are likely the same act."""
+    if norm_artist1 in norm_artist2 or norm_artist2 in norm_artist1:
+        return True
+    return difflib.SequenceMatcher(None, norm_artist1, norm_artist2).ratio() > 0.6
+
+
+def is_similar_title(norm_title1, norm_title2):
+    """Check if two normalized titles are the same or a close variant."""
+    if norm_title1 == norm_title2:
+        return True
+    # Upper bound on the similarity ratio from the lengths alone
+    if 2 * min(len(norm_title1), len(norm_title2)) < TITLE_SIMILARITY * (len(norm_title1) + len(norm_title2)):
+        return False
+    differing_words = set(norm_title1.split()) ^ set(norm_title2.split())
+    if any(word.isdigit() or word in NUMBER_WORDS for word in differing_words):
+        return False
+    matcher = difflib.SequenceMatcher(None, norm_title1, norm_title2)
+    return matcher.quick_ratio() >= TITLE_SIMILARITY and matcher.ratio() >= TITLE_SIMILARITY
+
+
+# Work units handed to each worker process
+NORMALIZE_CHUNK_SIZE = 5000
+VERIFY_CHUNK_SIZE = 20000
+
+
+def chunked(items, size):
+    """Split an iterable into lists of at most `size` items."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(executor, func, chunks):
+    """Apply func to every chunk, in a process pool if one is given; results keep chunk order."""
+    if executor is None:
+        return [func(chunk) for chunk in chunks]
+    return list(executor.map(func, chunks))
+
+
+def normalize_chunk(pairs):
+    """Normalize (title, artist) pairs and compute blocking keys for the titles long enough to compare."""
+    results = []
+    for title, artist in pairs:
+        norm_title, norm_artist = normalize_title(title), normalize_artist(artist)
+        # Skip very short titles
+        keys = lsh_keys(norm_title, norm_artist) if len(norm_title) > 3 else None
+        results.append((norm_title, norm_artist, keys))
+    return results
+
+
+def verify_chunk(pairs):
+    """Return the (i, j) candidate pairs whose normalized title and artist really are similar."""
+    return [(i, j) for i, j, norm_title1, norm_artist1, norm_title2, norm_artist2 in pairs
+            if is_similar_title(norm_title1, norm_title2) and is_similar_artist(norm_artist1, norm_artist2)]
+
+
+def candidate_pairs(keys_per_song):
+    """Yield each (i, j) pair of song indexes sharing at least one blocking key, once, with i < j."""
+    buckets = defaultdict(list)
+    for i, keys in enumerate(keys_per_song):
+        for key in keys:
+            buckets[key].append(i)
+
+    seen = set()
+    skipped = 0
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BUCKET_SIZE:
+            skipped += 1
+            continue
+        for position, i in enumerate(members):
+            for j in members[position + 1:]:
+                if (i, j) not in seen:
+                    seen.add((i, j))
+                    yield i, j
+    if skipped:
+        print(f"Skipped {skipped} oversized blocking buckets (> {MAX_BUCKET_SIZE} songs)")
+
+
+def find_near_duplicates(songs_list, executor=None):
+    """
+    Find songs that are likely duplicates but with slight variations.
+    Songs are blocked with MinHash/LSH over title+artist 3-grams, so only songs
+    that share a bucket are compared and the work stays near-linear in the
+    catalog size, while still catching fuzzy title variants.
+
+    With an executor, normalization and pair verification run in chunks across
+    its worker processes; results are merged in order, so the output is the
+    same as a single-process run.
+    """
+    # Normalize every song once
+    chunks = chunked(((song['title'], song['artist']) for song in songs_list), NORMALIZE_CHUNK_SIZE)
+    normalized = [song for chunk in map_chunks(executor, normalize_chunk, chunks) for song in chunk]
+
+    indexes = [i for i, (_, _, keys) in enumerate(normalized) if keys is not None]
+    keys_per_song = [normalized[i][2] for i in indexes]
+
+    def pair_details():
+        for a, b in sorted(candidate_pairs(keys_per_song)):
+            i, j = indexes[a], indexes[b]
+            yield i, j, normalized[i][0], normalized[i][1], normalized[j][0], normalized[j][1]
+
+    matches = map_chunks(executor, verify_chunk, chunked(pair_details(), VERIFY_CHUNK_SIZE))
+    return [(songs_list[i], songs_list[j]) for chunk in matches for i, j in chunk]
+
+
+def recommend_songs_to_keep(songs_list, executor=None):
     """Remove exact duplicates and suggest which near-duplicates to keep."""
     # First, remove exact duplicates
     unique_songs = remove_exact_duplicates(songs_list)
@@ -91,7 +213,7 @@ def recommend_songs_to_keep(songs_list):
     print(f"Removed {len(songs_list) - len(unique_songs)} exact duplicates\n")
 
     # Now find near-duplicates
-    near_duplicates = find_near_duplicates(unique_songs)
+    near_duplicates = find_near_duplicates(unique_songs, executor)
 
     if near_duplicates:
         print(f"Found {len(near_duplicates)} sets of near-duplicate songs:")
@@ -104,8 +226,11 @@ def recommend_songs_to_keep(songs_list):
             print(f"  1. '{song1['title']}' by {song1['artist']} ({song1['year']})")
             print(f"  2. '{song2['title']}' by {song2['artist']} ({song2['year']})")
 
+            # Fuzzy title matches are only flagged, never removed automatically
+            if normalize_title(song1['title']) != normalize_title(song2['title']):
+                print(f"  Recommendation: Manual review needed (similar titles)")
             # Simple heuristic: keep the original version if years differ significantly
-            if abs(song1['year'] - song2['year']) > 5:
+            elif abs(song1['year'] - song2['year']) > 5:
                 keep_song = song1 if song1['year'] < song2['year'] else song2
                 remove_song = song2 if song1['year'] < song2['year'] else song1
                 print(f"  Recommendation: Keep the {keep_song['year']} version")
@@ -132,13 +257,27 @@ def recommend_songs_to_keep(songs_list):
         return unique_songs
 
 
-def analyze_decade_distribution(songs_list):
-    """Analyze the distribution of songs by decade."""
-    decade_counts = defaultdict(int)
+def count_decades(songs_chunk):
+    """Count songs per decade."""
+    return Counter((song['year'] // 10) * 10 for song in songs_chunk)
 
-    for song in songs_list:
-        decade = (song['year'] // 10) * 10
-        decade_counts[decade] += 1
+
+def count_artists(songs_chunk):
+    """Count songs per primary artist."""
+    return Counter(primary_artist_name(song['artist']) for song in songs_chunk)
+
+
+def merge_counts(counters):
+    """Sum per-chunk counters in chunk order, so ties rank the same as in a single pass."""
+    total = Counter()
+    for counts in counters:
+        total.update(counts)
+    return total
+
+
+def analyze_decade_distribution(songs_list, executor=None):
+    """Analyze the distribution of songs by decade."""
+    decade_counts = merge_counts(map_chunks(executor, count_decades, chunked(songs_list, NORMALIZE_CHUNK_SIZE)))
 
     print("\nSong distribution by decade:")
     for decade in sorted(decade_counts.keys()):
@@ -146,14 +285,9 @@ def analyze_decade_distribution(songs_list):
         print(f"{decade}s: {decade_counts[decade]} songs ({percentage:.1f}%)")
 
 
-def analyze_artist_frequency(songs_list):
+def analyze_artist_frequency(songs_list, executor=None):
     """Analyze the frequency of artists in the collection."""
-    artist_counts = defaultdict(int)
-
-    for song in songs_list:
-        # Extract primary artist
-        artist = song['artist'].split("ft.")[0].split("feat.")[0].strip()
-        artist_counts[artist] += 1
+    artist_counts = merge_counts(map_chunks(executor, count_artists, chunked(songs_list, NORMALIZE_CHUNK_SIZE)))
 
     # Find top artists
     top_artists = sorted(artist_counts.items(), key=lambda x: x[1], reverse=True)[:20]
@@ -164,22 +298,33 @@ def analyze_artist_frequency(songs_list):
 
 
 def main():
-    # Load the songs from the JSON file
-    with open('songs.json', 'r', encoding='utf-8') as f:
-        songs = json.load(f)
-
-    # Process the songs
-    final_songs = recommend_songs_to_keep(songs)
-
-    # Analyze the cleaned dataset
-    analyze_decade_distribution(final_songs)
-    analyze_artist_frequency(final_songs)
+    parser = argparse.ArgumentParser(description="Remove duplicate songs and analyze the catalog.")
+    parser.add_argument('--songs', help="Catalog file to clean, .json or .ndjson (default: the configured storage)")
+    parser.add_argument('--output', default='cleaned_songs.json',
+                        help="Where to save the result, format chosen by extension (default: cleaned_songs.json)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes for normalization, comparison and analysis (default: 1)")
+    args = parser.parse_args()
+
+    # Load the songs from the catalog file, or from storage (files or SQLite, see STORAGE_BACKEND)
+    songs = list(iter_songs(args.songs)) if args.songs else list(storage_from_env().load_songs())
+
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        # Process the songs
+        final_songs = recommend_songs_to_keep(songs, executor)
+
+        # Analyze the cleaned dataset
+        analyze_decade_distribution(final_songs, executor)
+        analyze_artist_frequency(final_songs, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Save the results
-    with open('cleaned_songs.json', 'w', encoding='utf-8') as f:
-        json.dump(final_songs, f, ensure_ascii=False, indent=2)
+    write_songs(args.output, final_songs)
 
-    print(f"\nCleaned songs saved to cleaned_songs.json")
+    print(f"\nCleaned songs saved to {args.output}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+CORPUS_FILE = 'itunes_corpus.ndjson'
+ROUTES = ('/search', '/lookup')
+
+
+def request_key(path, query):
+    """Canonical form of a request, so the same search matches however its parameters are ordered or escaped."""
+    return f"{path}?{urlencode(sorted(parse_qsl(query, keep_blank_values=True)))}"
+
+
+def synthesize_results(params):
+    """A plausible answer for a request nobody recorded: song searches find one track named after the search term."""
+    if params.get('entity') != 'song' or 'term' not in params:
+        # Album searches and lookups find nothing, as for an obscure artist
+        return {"resultCount": 0, "results": []}
+    term = params['term']
+    track_id = zlib.crc32(term.encode('utf-8'))
+    track = {
+        "wrapperType": "track",
+        "trackName": term,
+        "artistName": params.get('artistTerm', term),
+        "collectionName": term,
+        "trackId": track_id,
+        "previewUrl": f"https://stub.invalid/preview/{track_id}.m4a"
+    }
+    return {"resultCount": 1, "results": [track]}
+
+
+class Corpus:
+    """
+    Recorded iTunes responses keyed by request_key(), kept in an NDJSON file
+    with one {"key", "status", "body"} object per line. Recordings are appended
+    as they arrive; a key recorded twice keeps its latest response.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry['key']] = (entry['status'], entry['body'])
+
+    def get(self, key):
+        return self.responses.get(key)
+
+    def record(self, key, status, body):
+        line = json.dumps({"key": key, "status": status, "body": body}, ensure_ascii=False) + '\n'
+        with self._lock:
+            self.responses[key] = (status, body)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+class FaultInjector:
+    """Decides, per request, how long to wait and whether to fail with an error status or a timeout."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_statuses=(429, 500, 503),
+                 timeout_rate=0.0, hang=30.0, retry_after=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Return (delay, fault) where fault is None, 'timeout' or an HTTP status."""
+        with self._lock:
+            delay = max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0.0)
+            roll = self._rng.random()
+            if roll < self.timeout_rate:
+                return self.hang, 'timeout'
+            if roll < self.timeout_rate + self.error_rate:
+                return delay, self._rng.choice(self.error_statuses)
+        return delay, None
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Serves /search and /lookup from the corpus, recording misses from the real API in record mode."""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API, so the app's connection pool gets reused
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path == '/__stats':
+            self.send_json(200, server.stats_snapshot())
+            return
+        if url.path not in ROUTES:
+            self.send_json(404, {"errorMessage": "Invalid request"})
+            return
+
+        server.count('requests')
+        delay, fault = server.faults.choose()
+        if fault == 'timeout':
+            # Hold the request open, then drop the connection without answering
+            server.count('timeouts')
+            time.sleep(delay)
+            self.close_connection = True
+            return
+        if delay:
+            time.sleep(delay)
+        if fault is not None:
+            server.count(f'status_{fault}')
+            headers = {}
+            if fault == 429 and server.faults.retry_after is not None:
+                headers['Retry-After'] = str(server.faults.retry_after)
+            self.send_json(fault, {"errorMessage": "Injected failure"}, headers)
+            return
+
+        key = request_key(url.path, url.query)
+        recorded = server.corpus.get(key)
+        if recorded is not None:
+            server.count('hits')
+            self.send_json(*recorded)
+            return
+
+        server.count('misses')
+        if server.upstream:
+            status, body = self.forward(url)
+            if status == 200:
+                server.corpus.record(key, status, body)
+                server.count('recorded')
+            self.send_json(status, body)
+        elif server.on_miss == 'synthesize':
+            self.send_json(200, synthesize_results(dict(parse_qsl(url.query))))
+        elif server.on_miss == 'error':
+            self.send_json(404, {"errorMessage": "Not recorded", "key": key})
+        else:
+            self.send_json(200, {"resultCount": 0, "results": []})
+
+    def forward(self, url):
+        """Fetch a request from the real API for recording; transient failures are passed on, not recorded."""
+        try:
+            response = self.server.session.get(f"{self.server.upstream}{url.path}?{url.query}", timeout=30)
+            return response.status_code, response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.server.count('upstream_errors')
+            return 502, {"errorMessage": f"Upstream request failed: {e}"}
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/javascript; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, corpus, faults, upstream=None, on_miss='empty', verbose=False):
+        super().__init__(address, StandinHandler)
+        self.corpus = corpus
+        self.faults = faults
+        self.upstream = upstream.rstrip('/') if upstream else None
+        self.session = requests.Session() if upstream else None
+        self.on_miss = on_miss
+        self.verbose = verbose
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def stats_snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats, corpus_size=len(self.corpus.responses))
+
+
+def parse_statuses(value):
+    try:
+        return tuple(int(status) for status in value.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma-separated list of HTTP statuses, e.g. 429,500,503")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the iTunes /search and /lookup APIs locally from recorded responses, "
+                    "with optional latency and failures. Point the app at it with ITUNES_BASE_URL.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--corpus', default=CORPUS_FILE, help=f"Recorded responses, NDJSON (default: {CORPUS_FILE})")
+    parser.add_argument('--record', action='store_true',
+                        help="Forward requests that aren't in the corpus to the real API and record the answers")
+    parser.add_argument('--upstream', default='https://itunes.apple.com',
+                        help="API to record from (default: https://itunes.apple.com)")
+    parser.add_argument('--on-miss', choices=['empty', 'synthesize', 'error'], default='empty',
+                        help="Answer for unrecorded requests when not recording: no results, a made-up track "
+                             "named after the search term, or a 404 (default: empty)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds to wait before each answer (default: 0)")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="Randomly vary the latency by up to this many seconds either way (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with an error status (default: 0)")
+    parser.add_argument('--error-statuses', type=parse_statuses, default=(429, 500, 503),
+                        help="Statuses to fail with (default: 429,500,503)")
+    parser.add_argument('--retry-after', type=int, help="Retry-After seconds to send with injected 429s")
+    parser.add_argument('--timeout-rate', type=float, default=0.0,
+                        help="Fraction of requests held open and then dropped without an answer (default: 0)")
+    parser.add_argument('--hang', type=float, default=30.0,
+                        help="Seconds to hold a timed-out request before dropping it (default: 30)")
+    parser.add_argument('--seed', type=int, help="Seed for the injected latency and failures")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    if args.error_rate + args.timeout_rate > 1:
+        parser.error("--error-rate and --timeout-rate add up to more than 1")
+
+    corpus = Corpus(args.corpus)
+    faults = FaultInjector(args.latency, args.jitter, args.error_rate, args.error_statuses,
+                           args.timeout_rate, args.hang, args.retry_after, args.seed)
+    server = StandinServer((args.host, args.port), corpus, faults,
+                           upstream=args.upstream if args.record else None, on_miss=args.on_miss, verbose=args.verbose)
+
+    mode = f"recording from {args.upstream}" if args.record else f"replaying, unrecorded requests: {args.on_miss}"
+    print(f"iTunes stand-in on http://{args.host}:{args.port} with {len(corpus.responses)} recorded responses ({mode})")
+    print(f"Run the app with ITUNES_BASE_URL=http://{args.host}:{args.port}; counters at /__stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
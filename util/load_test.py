@@ -0,0 +1,427 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+# Allow importing the app's modules when run as `python util/load_test.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+UTIL_DIR = os.path.dirname(os.path.abspath(__file__))
+DAILY_ROUND_LIMIT = 20  # Give up on a daily game that never ends rather than loop forever
+FREE_ROUNDS = 10
+FREE_RETRY_WAIT = 1.0  # Seconds a player waits when no free-play song is ready yet, like the page does
+
+
+class RequestFailed(Exception):
+    """A request returned an error status or never completed; the player abandons the game."""
+
+
+class StageOver(Exception):
+    """The stage's time is up; the player stops before sending another request."""
+
+
+def server_app(itunes_latency=None):
+    """
+    The app for the load-test server (also usable as a gunicorn factory:
+    'load_test:server_app()'). iTunes is stubbed out in-process unless
+    ITUNES_BASE_URL points the app at a real server such as util/itunes_standin.py.
+    """
+    import itunes
+    from app import create_app
+    from bench_endpoints import make_itunes_stub
+
+    app = create_app()
+    if 'ITUNES_BASE_URL' in os.environ:
+        return app
+    if itunes_latency is None:
+        itunes_latency = float(os.environ.get('LOAD_TEST_ITUNES_LATENCY', 0))
+    itunes.itunes_get = make_itunes_stub(itunes_latency)
+    return app
+
+
+def serve(port, itunes_latency):
+    """Run the app on Werkzeug's threaded server until killed."""
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, UTIL_DIR)
+    make_server('127.0.0.1', port, server_app(itunes_latency), threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, itunes_latency, itunes_url, workers, threads, log):
+    """Start the app in a child process so the load generator doesn't compete with it for the GIL."""
+    if kind == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--pythonpath', UTIL_DIR, '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--worker-class', 'gthread', '--threads', str(threads),
+                   'load_test:server_app()']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port),
+                   '--itunes-latency', str(itunes_latency)]
+    env = dict(os.environ, LOAD_TEST_ITUNES_LATENCY=str(itunes_latency))
+    if itunes_url:
+        env['ITUNES_BASE_URL'] = itunes_url
+    return subprocess.Popen(command, cwd=os.getcwd(), env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for_server(host, port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"The server exited with status {process.returncode} before accepting connections")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"The server didn't accept connections on {host}:{port} within {timeout} seconds")
+
+
+def raise_open_file_limit():
+    """Every player holds a connection, so allow as many open files as the system permits."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response; returns (status, headers, body) with header names lowercased."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server")
+    status = int(status_line.split()[1])
+    headers = defaultdict(list)
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()].append(value.strip())
+
+    if 'chunked' in headers.get('transfer-encoding', [''])[-1].lower():
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readline()
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length'][-1]))
+    else:
+        body = await reader.read()
+        headers['connection'] = ['close']
+    return status, headers, body
+
+
+class Player:
+    """One simulated browser: a keep-alive connection and a cookie jar."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = {}
+        self.reader = None
+        self.writer = None
+
+    async def _send(self, method, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "Accept: */*"]
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{name}={value}" for name, value in self.cookies.items()))
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            lines += ["Content-Type: application/json", f"Content-Length: {len(data)}"]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + data)
+        await self.writer.drain()
+        return await read_response(self.reader)
+
+    async def request(self, method, path, body=None):
+        """Send a request and return (status, body), following the server's cookies."""
+        reused = self.writer is not None
+        try:
+            status, headers, data = await asyncio.wait_for(self._send(method, path, body), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+            # The server closed an idle keep-alive connection; retry once on a new one
+            self.close()
+            status, headers, data = await asyncio.wait_for(self._send(method, path, body), self.timeout)
+
+        for cookie in headers.get('set-cookie', []):
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            self.cookies[name.strip()] = value.strip()
+        if headers.get('connection', [''])[-1].lower() == 'close':
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Stats:
+    """Latencies and errors per endpoint for one stage."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.unanswered = defaultdict(int)  # Errors with no response, so no latency sample
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+
+class Game:
+    """One player's game, recording each request under `<mode> <path>`."""
+
+    def __init__(self, player, stats, mode, stop_at, think, rng):
+        self.player = player
+        self.stats = stats
+        self.mode = mode
+        self.stop_at = stop_at
+        self.think = think
+        self.rng = rng
+
+    async def call(self, method, path, body=None, retry_status=None):
+        """Make a request; a `retry_status` answer is recorded under `<name> retry` and returns None."""
+        if time.monotonic() >= self.stop_at:
+            raise StageOver()
+        name = f"{self.mode} {path.split('?')[0]}"
+        start = time.perf_counter()
+        try:
+            status, data = await self.player.request(method, path, body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            self.stats.errors[name] += 1
+            self.stats.unanswered[name] += 1
+            raise RequestFailed(f"{name}: {e!r}") from e
+        if status == retry_status:
+            self.stats.latencies[f"{name} retry"].append(time.perf_counter() - start)
+            return None
+        self.stats.latencies[name].append(time.perf_counter() - start)
+        if status >= 400:
+            self.stats.errors[name] += 1
+            raise RequestFailed(f"{name} returned {status}")
+        if self.think:
+            # Players listen to the preview and think before the next request
+            delay = self.rng.expovariate(1 / self.think)
+            await asyncio.sleep(min(delay, max(self.stop_at - time.monotonic(), 0)))
+        return data
+
+    async def call_json(self, method, path, body=None, retry_status=None):
+        data = await self.call(method, path, body, retry_status)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise RequestFailed(f"{path} returned invalid JSON") from e
+
+    async def play_daily(self):
+        await self.call('GET', '/daily')
+        for _ in range(DAILY_ROUND_LIMIT):
+            song = await self.call_json('GET', '/get-song')
+            if song.get('gameOver'):
+                return
+            result = await self.call_json('POST', '/check-guess', {"guess": song['year'] + self.rng.randint(-10, 10)})
+            if result.get('game_over'):
+                return
+
+    async def play_free(self):
+        await self.call('GET', '/free?unlimited=true')
+        for _ in range(FREE_ROUNDS):
+            # 503 means no song's preview has resolved yet
+            song = await self.call_json('GET', '/get-song', retry_status=503)
+            while song is None:
+                await asyncio.sleep(FREE_RETRY_WAIT)
+                song = await self.call_json('GET', '/get-song', retry_status=503)
+            await self.call_json('POST', '/check-guess', {"guess": song['year'] + self.rng.randint(-5, 5)})
+
+
+async def virtual_player(host, port, stats, stop_at, options, rng):
+    """Play games back to back, each as a new visitor, until the stage ends."""
+    # Arrive at a random moment in the first seconds of the stage, not all at once
+    await asyncio.sleep(rng.uniform(0, options.spread))
+    while time.monotonic() < stop_at:
+        player = Player(host, port, options.timeout)
+        mode = 'free' if rng.random() < options.free_ratio else 'daily'
+        game = Game(player, stats, mode, stop_at, options.think, rng)
+        try:
+            await (game.play_free() if mode == 'free' else game.play_daily())
+        except (RequestFailed, StageOver, KeyError, TypeError):
+            pass
+        finally:
+            player.close()
+
+
+async def run_stage(host, port, players, seconds, options, seed):
+    stats = Stats()
+    stop_at = time.monotonic() + seconds
+    await asyncio.gather(*(virtual_player(host, port, stats, stop_at, options, random.Random(seed + i))
+                           for i in range(players)))
+    stats.finish()
+    return stats
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(stats):
+    """{endpoint: metrics} for a stage, plus an 'all' row."""
+    results = {}
+    names = sorted(set(stats.latencies) | set(stats.errors))
+    for name in names + ['all']:
+        if name == 'all':
+            samples = sorted(latency for values in stats.latencies.values() for latency in values)
+            errors = sum(stats.errors.values())
+            unanswered = sum(stats.unanswered.values())
+        else:
+            samples = sorted(stats.latencies[name])
+            errors = stats.errors[name]
+            unanswered = stats.unanswered[name]
+        attempts = len(samples) + unanswered
+        results[name] = {
+            "requests": attempts,
+            "throughput": (len(samples) - errors + unanswered) / stats.elapsed if stats.elapsed else 0.0,
+            "errors": errors,
+            "error_rate": errors / attempts if attempts else 0.0,
+            "p50": percentile(samples, 0.50) * 1000,
+            "p95": percentile(samples, 0.95) * 1000,
+            "p99": percentile(samples, 0.99) * 1000
+        }
+    return results
+
+
+def print_stage(players, stats, results):
+    print(f"\n{players} players, {stats.elapsed:.1f} s")
+    print(f"{'endpoint':<22}{'requests':>9}{'req/s':>9}{'errors':>8}{'err %':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, metrics in results.items():
+        print(f"{name:<22}{metrics['requests']:>9}{metrics['throughput']:>9.1f}{metrics['errors']:>8}"
+              f"{metrics['error_rate'] * 100:>7.2f}{metrics['p50']:>9.1f}{metrics['p95']:>9.1f}{metrics['p99']:>9.1f}")
+
+
+def parse_stages(value):
+    try:
+        stages = [int(players) for players in value.split(',') if players.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a comma-separated list of player counts, e.g. 50,200,1000")
+    if not stages or min(stages) < 1:
+        raise argparse.ArgumentTypeError("every stage needs at least one player")
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the game with concurrent simulated players, e.g. a midnight daily-challenge rush. "
+                    "Starts the app locally with iTunes stubbed out unless --url is given.")
+    parser.add_argument('--stages', type=parse_stages, default=[10, 50, 200],
+                        help="Concurrent players in each stage, ramping up (default: 10,50,200)")
+    parser.add_argument('--stage-seconds', type=float, default=15, help="Length of each stage (default: 15)")
+    parser.add_argument('--spread', type=float, default=2,
+                        help="Seconds over which a stage's players arrive (default: 2)")
+    parser.add_argument('--free-ratio', type=float, default=0.2,
+                        help="Fraction of games that are free play rather than the daily challenge (default: 0.2)")
+    parser.add_argument('--think', type=float, default=0,
+                        help="Mean seconds a player waits between requests (default: 0, as fast as possible)")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request counts as failed (default: 30)")
+    parser.add_argument('--url', help="Test an already running server, e.g. http://127.0.0.1:10000, instead of starting one")
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug',
+                        help="Server to start the app on (default: werkzeug)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="gunicorn workers; with more than one, set SESSION_BACKEND=sqlite (default: 1)")
+    parser.add_argument('--threads', type=int, default=8, help="gunicorn threads per worker (default: 8)")
+    parser.add_argument('--itunes-latency', type=float, default=0.0,
+                        help="Seconds the in-process iTunes stub waits before answering (default: 0)")
+    parser.add_argument('--itunes-url',
+                        help="Send iTunes requests over HTTP to this server instead, e.g. util/itunes_standin.py "
+                             "at http://127.0.0.1:8765")
+    parser.add_argument('--server-log', help="Write the server's output here instead of discarding it")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the players' choices (default: 0)")
+    parser.add_argument('--output', help="Also write the results to this JSON file")
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help="Exit with status 1 if any stage's error rate is higher (default: 0.01)")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.itunes_latency)
+        return
+    if args.server == 'gunicorn' and not args.url and importlib.util.find_spec('gunicorn') is None:
+        parser.error("gunicorn isn't installed")
+
+    raise_open_file_limit()
+    process = None
+    log = None
+    if args.url:
+        address = args.url.split('://', 1)[-1].rstrip('/')
+        host, _, port = address.partition(':')
+        port = int(port or 80)
+    else:
+        host, port = '127.0.0.1', free_port()
+        log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+        process = start_server(args.server, port, args.itunes_latency, args.itunes_url, args.workers, args.threads, log)
+
+    all_results = []
+    try:
+        wait_for_server(host, port, process)
+        for number, players in enumerate(args.stages):
+            stats = asyncio.run(run_stage(host, port, players, args.stage_seconds, args, args.seed + number * 100003))
+            results = summarize(stats)
+            print_stage(players, stats, results)
+            all_results.append({"players": players, "seconds": stats.elapsed, "endpoints": results})
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if log not in (None, subprocess.DEVNULL):
+            log.close()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(all_results, f, indent=2)
+
+    failed = [stage['players'] for stage in all_results if stage['endpoints']['all']['error_rate'] > args.max_error_rate]
+    if failed:
+        print(f"\nError rate above {args.max_error_rate:.1%} with {', '.join(map(str, failed))} players")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+
+# Allow importing the app's modules when run as `python util/migrate_storage.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CURATED_FILE, SONGS_FILE
+from storage import RESOLVED_FILE, FileStorage, SQLiteStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the song catalog, curated songs and resolved previews into SQLite.")
+    parser.add_argument('--songs', default=SONGS_FILE, help=f"Song catalog, .json or .ndjson (default: {SONGS_FILE})")
+    parser.add_argument('--curated', default=CURATED_FILE, help=f"Curated songs (default: {CURATED_FILE})")
+    parser.add_argument('--resolved', default=RESOLVED_FILE, help=f"Resolved previews (default: {RESOLVED_FILE})")
+    parser.add_argument('--db', default=os.environ.get('STORAGE_DB', 'yearworm.db'),
+                        help="SQLite database to create or replace the contents of (default: yearworm.db)")
+    args = parser.parse_args()
+
+    # Reading through FileStorage includes anything still waiting in the journals
+    source = FileStorage(args.songs, args.curated, args.resolved)
+    songs = source.load_songs()
+    curated_songs = source.load_curated()
+    resolved_entries = source.load_resolved_entries()
+
+    SQLiteStorage(args.db).import_data(songs, curated_songs, resolved_entries)
+    print(f"Migrated {len(songs)} songs, {len(curated_songs)} curated dates and "
+          f"{len(resolved_entries)} resolved previews to {args.db}")
+    print(f"Run the app with STORAGE_BACKEND=sqlite STORAGE_DB={args.db} to use it.")
+
+
+if __name__ == "__main__":
+    main()
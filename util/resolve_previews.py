@@ -0,0 +1,99 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+# Allow importing the app's modules when run as `python util/resolve_previews.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itunes
+from catalog import iter_songs
+from storage import RESOLVED_FILE, storage_from_env
+
+
+def resolve_song(song):
+    """Resolve one song. Returns the enriched entry, or raises if iTunes couldn't be reached."""
+    track = itunes.find_preview_track(song['title'], song['artist'])
+    return {
+        "title": song['title'],
+        "artist": song['artist'],
+        "year": song['year'],
+        "previewUrl": track.get('previewUrl') if track else None,
+        "trackId": track.get('trackId') if track else None,
+        "resolvedAt": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve iTunes preview URLs for the whole song catalog ahead of time.")
+    parser.add_argument('--songs', help="Catalog file to resolve, .json or .ndjson (default: the configured storage)")
+    parser.add_argument('--output', default=RESOLVED_FILE,
+                        help=f"Enriched catalog to write with file storage (default: {RESOLVED_FILE})")
+    parser.add_argument('--workers', type=int, default=4, help="Number of concurrent lookups (default: 4)")
+    parser.add_argument('--rps', type=float, default=1.0, help="Maximum iTunes requests per second across all workers (default: 1)")
+    parser.add_argument('--checkpoint', type=int, default=25, help="Save progress every N songs (default: 25)")
+    parser.add_argument('--retry-missing', action='store_true', help="Retry songs previously resolved without a preview")
+    parser.add_argument('--limit', type=int, help="Only resolve this many songs in this run")
+    args = parser.parse_args()
+
+    # Results go to songs_resolved.json, or to the previews table with STORAGE_BACKEND=sqlite
+    storage = storage_from_env(resolved_path=args.output)
+    songs = list(iter_songs(args.songs)) if args.songs else list(storage.load_songs())
+    resolved = storage.load_resolved_entries()
+
+    # Pick up where the last run left off
+    pending = []
+    seen = set()
+    for song in songs:
+        key = itunes.preview_cache_key(song['title'], song['artist'])
+        if key in seen:
+            continue
+        seen.add(key)
+        entry = resolved.get(key)
+        if entry is None or (args.retry_missing and not entry.get('previewUrl')):
+            pending.append(song)
+    if args.limit is not None:
+        pending = pending[:args.limit]
+
+    print(f"Loaded {len(songs)} songs, {len(resolved)} already resolved, {len(pending)} to go")
+    if not pending:
+        return
+
+    itunes.rate_limiter = itunes.RateLimiter(args.rps)
+    found = failed = done = 0
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    try:
+        futures = {executor.submit(resolve_song, song): song for song in pending}
+        for future in as_completed(futures):
+            song = futures[future]
+            done += 1
+            try:
+                entry = future.result()
+            except Exception as e:
+                # Leave it unresolved so the next run retries it
+                failed += 1
+                print(f"[{done}/{len(pending)}] Failed: {song['title']} by {song['artist']} ({e})")
+                continue
+
+            resolved[itunes.preview_cache_key(song['title'], song['artist'])] = entry
+            if entry['previewUrl']:
+                found += 1
+            print(f"[{done}/{len(pending)}] {'Found' if entry['previewUrl'] else 'No preview'}: "
+                  f"{song['title']} by {song['artist']}")
+
+            if done % args.checkpoint == 0:
+                storage.save_resolved_previews(songs, resolved)
+    except KeyboardInterrupt:
+        print("\nInterrupted, saving progress...")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        storage.save_resolved_previews(songs, resolved)
+
+    print(f"\nResolved {done - failed} songs ({found} with previews, {failed} failed)")
+    print(f"Resolved previews saved to {getattr(storage, 'resolved_path', storage.location)}")
+
+
+if __name__ == "__main__":
+    main()